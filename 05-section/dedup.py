@@ -0,0 +1,113 @@
+import re
+import zlib
+
+import numpy as np
+
+# Mersenne prime, so (a * h + b) stays below 2**63 for h, a, b < PRIME.
+PRIME = np.uint64((1 << 31) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+TOKEN_RE = re.compile(r"\w+")
+# Bound on the elements of the (shingles, permutations) matrix permuted at once: 32MB of uint64.
+MAX_BLOCK_ELEMENTS = 1 << 22
+
+
+def shingle_hashes(text, k=5):
+    """
+    Hashes of the word k-grams of `text`, combined from per-token hashes with
+    NumPy. Text without word tokens hashes as a whole, so it only matches an
+    exact copy of itself.
+    """
+    tokens = TOKEN_RE.findall(text.lower())
+    if not tokens:
+        return np.array([zlib.crc32(text.encode("utf-8"))], dtype=np.uint64) % PRIME
+    h = np.array([zlib.crc32(t.encode("utf-8")) for t in tokens], dtype=np.uint64)
+    if len(h) <= k:
+        k = len(h)
+    n = len(h) - k + 1
+    out = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        out = (out * np.uint64(1000003) + h[j : j + n]) & MAX_HASH
+    return np.unique(out % PRIME)
+
+
+def _blocks(sizes, max_size):
+    """Split positions into consecutive blocks whose sizes sum to at most `max_size`, or to one oversized item."""
+    start, total = 0, 0
+    for i, size in enumerate(sizes):
+        if total and total + size > max_size:
+            yield start, i
+            start, total = i, 0
+        total += size
+    if start < len(sizes):
+        yield start, len(sizes)
+
+
+def minhash_signatures(texts, num_perm=128, k=5, seed=0, max_block_elements=MAX_BLOCK_ELEMENTS):
+    """
+    (len(texts), num_perm) MinHash signatures. Shingle hashes of a block of
+    documents are concatenated and permuted together, then reduced per
+    document with np.minimum.reduceat. Blocks hold at most
+    `max_block_elements` shingle-permutation pairs, splitting permutations
+    too when one document has more shingles than fit in a block.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, int(PRIME), num_perm, dtype=np.uint64)
+    b = rng.integers(0, int(PRIME), num_perm, dtype=np.uint64)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    hashes = [shingle_hashes(t, k) for t in texts]
+    for start, end in _blocks([len(h) for h in hashes], max(1, max_block_elements // num_perm)):
+        offsets = np.cumsum([0] + [len(h) for h in hashes[start : end - 1]])
+        block = np.concatenate(hashes[start:end])[:, None]
+        step = max(1, max_block_elements // len(block))
+        for p in range(0, num_perm, step):
+            permuted = (block * a[p : p + step] + b[p : p + step]) % PRIME
+            signatures[start:end, p : p + step] = np.minimum.reduceat(permuted, offsets, axis=0)
+    return signatures
+
+
+def connected_components(n, src, dst):
+    """Lowest position in the component of each node, by min-label propagation with pointer jumping."""
+    labels = np.arange(n)
+    while True:
+        new = labels.copy()
+        np.minimum.at(new, src, labels[dst])
+        np.minimum.at(new, dst, labels[src])
+        new = new[new]
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+
+def lsh_clusters(signatures, bands=16, threshold=0.8):
+    """
+    Cluster near-duplicate documents. Signatures are split into `bands`
+    bands; documents sharing a band bucket are candidates, and each candidate
+    is joined to the first document of its bucket if their signatures agree
+    on at least `threshold` of positions. Work is linear in the number of
+    documents plus candidates, not quadratic. Returns, for each document, the
+    position of its cluster representative, the lowest position in the cluster.
+    """
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    src, dst = [], []
+    for band in range(bands):
+        chunk = np.ascontiguousarray(signatures[:, band * rows : (band + 1) * rows])
+        keys = chunk.view(np.dtype((np.void, chunk.dtype.itemsize * rows))).ravel()
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        heads = first[inverse.ravel()]
+        candidates = np.nonzero(heads != np.arange(n))[0]
+        if len(candidates) == 0:
+            continue
+        agreement = (signatures[candidates] == signatures[heads[candidates]]).mean(axis=1)
+        src.append(candidates[agreement >= threshold])
+        dst.append(heads[src[-1]])
+    if not src:
+        return np.arange(n)
+    return connected_components(n, np.concatenate(src), np.concatenate(dst))
+
+
+def dedup(texts, num_perm=128, bands=16, threshold=0.8, k=5):
+    """Representative position of each text; texts whose representative is itself are kept."""
+    if len(texts) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return lsh_clusters(minhash_signatures(texts, num_perm=num_perm, k=k), bands=bands, threshold=threshold)
@@ -3,7 +3,6 @@ from metaflow.cards import Image, Markdown
 from matplotlib import pyplot as plt
 
 try: # packages included in task Docker container
-    import tldextract
     import seaborn as sns
     sns.set_style("dark")
     COLORS = {
@@ -53,6 +52,20 @@ class DataTableProcessor(FlowSpec):
         type=int,
     )
 
+    dedup = Parameter(
+        "dedup",
+        help="Whether to drop near-duplicate chunks, keeping one representative per cluster.",
+        default=True,
+        type=bool,
+    )
+
+    dedup_threshold = Parameter(
+        "dedup_threshold",
+        help="The estimated Jaccard similarity of word 5-gram shingles above which two chunks are duplicates.",
+        default=0.8,
+        type=float,
+    )
+
     def plot_char_word_histogram(self, char_count_threshold=0, word_count_threshold=0, _df=None, title="", ):
         fig, ax = plt.subplots(1, 2, figsize=(12, 4))
         ax[0] = _df.char_count.plot.hist(bins=self.n_bins, color=COLORS['purple'], ax=ax[0])
@@ -110,18 +123,20 @@ class DataTableProcessor(FlowSpec):
             fig = self.plot_char_word_histogram(_df = df, title="Before filtering")
             current.card.append(Image.from_matplotlib(fig))
 
-            # Filter out rows with less than N words.
-            _df = df[df.word_count > self.word_count_threshold]
-
-            # Filter out rows with less than M chars.
-            _df = _df[_df.char_count > self.char_count_threshold]
-
-            # Feature: Add a column for the top level domain.
-            _df['tld'] = _df['page_url'].apply(lambda url: "https://" + tldextract.extract(url).fqdn)
-
-            # Reindex and keep index in upstream dataframe.
-            _df.reset_index(inplace=True)
-            _df.index = range(len(_df))
+            # Filter short and near-duplicate chunks, add features, and reindex.
+            from processing import process_chunks
+            _df, self.duplicate_clusters = process_chunks(
+                df,
+                word_count_threshold=self.word_count_threshold,
+                char_count_threshold=self.char_count_threshold,
+                dedup_threshold=self.dedup_threshold if self.dedup else None,
+            )
+            if self.dedup:
+                self.n_duplicates_removed = sum(len(c) for c in self.duplicate_clusters.values())
+                message = "Removed {} near-duplicate chunks in {} clusters, {} chunks remain.".format(
+                    self.n_duplicates_removed, len(self.duplicate_clusters), len(_df))
+                print(message)
+                current.card.append(Markdown(message))
 
             fig = self.plot_char_word_histogram(
                 word_count_threshold=self.word_count_threshold, 
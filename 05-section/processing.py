@@ -0,0 +1,47 @@
+import numpy as np
+
+from dedup import dedup
+
+
+def near_duplicate_clusters(_df, threshold=0.8):
+    """
+    Mask of the chunks to keep, one per near-duplicate cluster, and a map from
+    each kept chunk's upstream index to the upstream indices of the chunks it replaces.
+    """
+    representatives = dedup(_df.contents.tolist(), threshold=threshold)
+    keep = representatives == np.arange(len(_df))
+    upstream_index = _df.index.to_numpy()
+    clusters = {}
+    for i in np.nonzero(~keep)[0]:
+        clusters.setdefault(int(upstream_index[representatives[i]]), []).append(int(upstream_index[i]))
+    return keep, clusters
+
+
+def process_chunks(df, word_count_threshold=10, char_count_threshold=25, dedup_threshold=0.8):
+    """
+    The row filters and features of DataTableProcessor: drop short chunks and,
+    unless `dedup_threshold` is None, near-duplicate chunks, then add the
+    top-level domain of each page and reindex, keeping the upstream index in
+    an `index` column. Returns the processed dataframe and the duplicate clusters.
+    """
+    import tldextract
+
+    # Filter out rows with less than N words.
+    _df = df[df.word_count > word_count_threshold]
+
+    # Filter out rows with less than M chars.
+    _df = _df[_df.char_count > char_count_threshold]
+
+    # Filter out near-duplicate chunks, keeping the first of each cluster.
+    clusters = {}
+    if dedup_threshold is not None:
+        keep, clusters = near_duplicate_clusters(_df, dedup_threshold)
+        _df = _df[keep]
+
+    # Feature: Add a column for the top level domain.
+    _df = _df.assign(tld=_df['page_url'].apply(lambda url: "https://" + tldextract.extract(url).fqdn))
+
+    # Reindex and keep index in upstream dataframe.
+    _df = _df.reset_index()
+    _df.index = range(len(_df))
+    return _df, clusters
@@ -0,0 +1,88 @@
+import random
+
+import numpy as np
+import pytest
+
+from dedup import PRIME, dedup, lsh_clusters, minhash_signatures, shingle_hashes, connected_components
+
+WORDS = ["flow", "step", "artifact", "run", "card", "deploy", "trigger", "retry", "resource", "namespace"]
+
+
+def random_text(rng, n_words):
+    return " ".join(rng.choice(WORDS) + str(rng.randrange(1000)) for _ in range(n_words))
+
+
+def naive_minhash(texts, num_perm=128, k=5, seed=0):
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, int(PRIME), num_perm, dtype=np.uint64)
+    b = rng.integers(0, int(PRIME), num_perm, dtype=np.uint64)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    for i, text in enumerate(texts):
+        hashes = [int(h) for h in shingle_hashes(text, k)]
+        for p in range(num_perm):
+            signatures[i, p] = min((h * int(a[p]) + int(b[p])) % int(PRIME) for h in hashes)
+    return signatures
+
+
+@pytest.mark.parametrize("max_block_elements", [1 << 22, 256, 16])
+def test_signatures_match_naive_minhash(max_block_elements):
+    rng = random.Random(0)
+    # a mix of short, empty and long texts, so small blocks split both documents and permutations
+    texts = [random_text(rng, n) for n in (1, 3, 8, 40, 200)] + ["", "!!! ---", random_text(rng, 12)]
+    expected = naive_minhash(texts, num_perm=16)
+    signatures = minhash_signatures(texts, num_perm=16, max_block_elements=max_block_elements)
+    np.testing.assert_array_equal(signatures, expected)
+
+
+def test_planted_near_duplicate_clusters():
+    rng = random.Random(1)
+    texts, planted = [], []
+    for cluster in range(5):
+        base = random_text(rng, 150).split()
+        members = []
+        for _ in range(3):
+            copy = list(base)
+            copy[rng.randrange(len(copy))] = "edited"
+            members.append(len(texts))
+            texts.append(" ".join(copy))
+        planted.append(members)
+    unique = [len(texts) + i for i in range(20)]
+    texts += [random_text(rng, 150) for _ in range(20)]
+
+    representatives = dedup(texts)
+    for members in planted:
+        assert all(representatives[m] == members[0] for m in members)
+    assert all(representatives[u] == u for u in unique)
+
+
+def test_token_less_chunks_only_match_exact_copies():
+    representatives = dedup(["!!! ---", "### ***", "!!! ---", "```", "hello world again and again"])
+    assert list(representatives) == [0, 1, 0, 3, 4]
+
+
+def test_connected_components_follow_chains():
+    # 4 - 3 - 0 and 1 - 5, joined through chains that need more than one propagation round
+    labels = connected_components(7, np.array([4, 3, 5]), np.array([3, 0, 1]))
+    assert list(labels) == [0, 1, 2, 0, 0, 1, 6]
+
+
+def test_lsh_clusters_threshold():
+    signatures = np.zeros((3, 16), dtype=np.uint32)
+    signatures[1, :4] = 1  # agrees with row 0 on 12 of 16 positions
+    signatures[2, :] = 7
+    assert list(lsh_clusters(signatures, bands=4, threshold=0.7)) == [0, 0, 2]
+    assert list(lsh_clusters(signatures, bands=4, threshold=0.8)) == [0, 1, 2]
+
+
+def test_near_duplicate_clusters_map_upstream_indices():
+    pd = pytest.importorskip("pandas")
+    from processing import near_duplicate_clusters
+
+    rng = random.Random(2)
+    base = random_text(rng, 100)
+    contents = [random_text(rng, 100), base, random_text(rng, 100), base + " edited", base]
+    df = pd.DataFrame({"contents": contents}, index=[10, 11, 12, 13, 14])
+
+    keep, clusters = near_duplicate_clusters(df)
+    assert list(keep) == [True, True, True, False, False]
+    assert clusters == {11: [13, 14]}
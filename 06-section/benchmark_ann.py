@@ -0,0 +1,60 @@
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+from vector_store import IVFVectorStore, benchmark
+
+
+def synthetic_embeddings(n, dimension, n_clusters=100, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dimension)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, n)
+    return centers[labels] + 0.5 * rng.standard_normal((n, dimension)).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall and latency of the local IVF index vs. exact search.")
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--storage", nargs="+", default=["float32", "float16", "int8"])
+    parser.add_argument("--no-rescore", action="store_true")
+    args = parser.parse_args()
+
+    x = synthetic_embeddings(args.n + args.queries, args.dimension)
+    vectors, queries = x[: args.n], x[args.n :]
+    ids = [str(i) for i in range(args.n)]
+
+    for storage in args.storage:
+        start = time.perf_counter()
+        store = IVFVectorStore.build(ids, vectors, storage=storage, rescore=not args.no_rescore)
+        build_s = time.perf_counter() - start
+
+        with tempfile.TemporaryDirectory() as path:
+            store.save(path)
+            store = IVFVectorStore.load(path)
+            first_pass_bytes, rescoring_bytes = store.nbytes()
+            for n_probe in args.n_probe:
+                store.n_probe = n_probe
+                report = benchmark(store, ids, vectors, queries, k=args.k)
+                report.update(
+                    n=args.n,
+                    dimension=args.dimension,
+                    n_probe=n_probe,
+                    storage=storage,
+                    rescore=storage != "float32" and not args.no_rescore,
+                    build_s=build_s,
+                    first_pass_bytes=first_pass_bytes,
+                    rescoring_bytes=rescoring_bytes,
+                    float32_bytes=vectors.nbytes,
+                )
+                print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
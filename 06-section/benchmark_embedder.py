@@ -0,0 +1,51 @@
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+from onnx_embedder import OnnxEmbedder, export_onnx, parity, PARITY_TEXTS
+
+
+def throughput(embed, texts, repeats=3):
+    embed(texts[:8])
+    start = time.perf_counter()
+    for _ in range(repeats):
+        embed(texts)
+    return repeats * len(texts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Parity and throughput of the int8 ONNX Runtime embedder vs. PyTorch."
+    )
+    parser.add_argument("--model", default="paraphrase-MiniLM-L6-v2", help="Model name or local path.")
+    parser.add_argument("--n", type=int, default=1024, help="Number of texts for the throughput run.")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--min-cosine", type=float, default=0.98)
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+
+    # sorted by length, as EmbeddingEngine batches them, so neither backend pads short texts to long ones
+    texts = sorted((PARITY_TEXTS[i % len(PARITY_TEXTS)] + " " + str(i) for i in range(args.n)), key=len)
+    reference = SentenceTransformer(args.model, device="cpu")
+    with tempfile.TemporaryDirectory() as path:
+        export_onnx(args.model, path)
+        onnx = OnnxEmbedder(path, intra_op_threads=args.threads)
+        cosine = parity(args.model, path)
+        report = {
+            "model": args.model,
+            "min_cosine": float(cosine.min()),
+            "mean_cosine": float(cosine.mean()),
+            "pytorch_docs_per_sec": throughput(lambda t: reference.encode(t, batch_size=64), texts),
+            "onnx_int8_docs_per_sec": throughput(onnx.embed, texts),
+        }
+    print(json.dumps(report))
+    if report["min_cosine"] < args.min_cosine:
+        print("Parity check failed: min cosine %.4f < %.4f" % (report["min_cosine"], args.min_cosine))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import os
+import json
+import shutil
+import hashlib
+
+import numpy as np
+
+# A cache written before segments existed is one segment in this file.
+VECTORS_FILE = "vectors.f32"
+INDEX_FILE = "index.json"
+
+
+def content_key(model_name, text):
+    return hashlib.sha1(("%s\0%s" % (model_name, text)).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Embeddings keyed by (model name, text hash), stored in a directory as
+    append-only segments: raw float32 matrices, read back with np.memmap, and
+    a JSON index of each segment's file and row keys. Each call to `embed`
+    writes the vectors of its misses as one new segment, so existing vectors
+    are never copied or re-uploaded and chunks that leave the corpus stay
+    cached.
+    """
+
+    def __init__(self, path, model_name):
+        self.path = path
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+        self.updated = False
+        os.makedirs(path, exist_ok=True)
+
+    def _read_index(self):
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return None
+        with open(index_path) as f:
+            index = json.load(f)
+        if index["model"] != self.model_name:
+            return None
+        if "segments" not in index:
+            index["segments"] = [{"file": VECTORS_FILE, "keys": index.pop("keys")}]
+        return index
+
+    def _read(self):
+        """The dimension and a list of (keys, memmap) segments; segments whose file is missing or short are skipped."""
+        index = self._read_index()
+        if index is None:
+            return None, []
+        dimension, segments = index["dimension"], []
+        for segment in index["segments"]:
+            vectors_path = os.path.join(self.path, segment["file"])
+            n_bytes = len(segment["keys"]) * dimension * np.dtype(np.float32).itemsize
+            if not segment["keys"] or not os.path.exists(vectors_path) or os.path.getsize(vectors_path) < n_bytes:
+                continue
+            vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(len(segment["keys"]), dimension))
+            segments.append((segment["keys"], vectors))
+        return dimension, segments
+
+    def _append_segment(self, keys, vectors):
+        name = "vectors-%s.f32" % hashlib.sha1("".join(keys).encode("utf-8")).hexdigest()[:16]
+        tmp_path = os.path.join(self.path, name + ".tmp")
+        np.ascontiguousarray(vectors, dtype=np.float32).tofile(tmp_path)
+        os.replace(tmp_path, os.path.join(self.path, name))
+
+        # the index is replaced after the segment is complete, so readers never see a partial segment
+        index = self._read_index() or {"model": self.model_name, "dimension": vectors.shape[1], "segments": []}
+        index["segments"] = [seg for seg in index["segments"] if seg["file"] != name] + [{"file": name, "keys": keys}]
+        tmp_path = os.path.join(self.path, INDEX_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, os.path.join(self.path, INDEX_FILE))
+        return np.memmap(os.path.join(self.path, name), dtype=np.float32, mode="r", shape=vectors.shape)
+
+    def embed(self, docs, encode):
+        """
+        Return a (len(docs), dimension) float32 array, calling `encode` only on
+        texts whose key is not in the cache. If the cache holds exactly `docs`
+        in order in one segment, that segment's memmap is returned as-is;
+        otherwise rows are gathered from the segments.
+        """
+        keys = [content_key(self.model_name, doc) for doc in docs]
+        if not keys:
+            return np.asarray(encode([]), dtype=np.float32)
+        dimension, segments = self._read()
+        if len(segments) == 1 and segments[0][0] == keys:
+            self.hits, self.misses = len(keys), 0
+            return segments[0][1]
+
+        rows = {}
+        for s, (segment_keys, _) in enumerate(segments):
+            for row, key in enumerate(segment_keys):
+                rows[key] = (s, row)
+        miss_positions = {}
+        for i, key in enumerate(keys):
+            if key not in rows:
+                miss_positions.setdefault(key, []).append(i)
+        self.misses = sum(len(positions) for positions in miss_positions.values())
+        self.hits = len(keys) - self.misses
+
+        if miss_positions:
+            miss_keys = list(miss_positions)
+            new_vectors = np.asarray(encode([docs[miss_positions[k][0]] for k in miss_keys]), dtype=np.float32)
+            if dimension is not None and new_vectors.shape[1] != dimension:
+                raise ValueError(
+                    "Encoder returned {}-dimensional vectors for a cache of dimension {}.".format(
+                        new_vectors.shape[1], dimension
+                    )
+                )
+            segments.append((miss_keys, self._append_segment(miss_keys, new_vectors)))
+            self.updated = True
+            for row, key in enumerate(miss_keys):
+                rows[key] = (len(segments) - 1, row)
+            if len(segments) == 1 and miss_keys == keys:
+                return segments[0][1]
+
+        located = np.array([rows[key] for key in keys], dtype=np.int64)
+        out = np.empty((len(keys), segments[0][1].shape[1]), dtype=np.float32)
+        for s, (_, vectors) in enumerate(segments):
+            positions = np.nonzero(located[:, 0] == s)[0]
+            if len(positions):
+                out[positions] = vectors[located[positions, 1]]
+        return out
+
+
+def pull_cache(s3root, path):
+    """Download the index and the segments missing from `path`."""
+    from metaflow import S3
+
+    os.makedirs(path, exist_ok=True)
+    with S3(s3root=s3root) as s3:
+        obj = s3.get(INDEX_FILE, return_missing=True)
+        if not obj.exists:
+            return
+        shutil.copy(obj.path, os.path.join(path, INDEX_FILE))
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            index = json.load(f)
+        files = [seg["file"] for seg in index.get("segments", [{"file": VECTORS_FILE}])]
+        missing = [name for name in files if not os.path.exists(os.path.join(path, name))]
+        for obj in s3.get_many(missing, return_missing=True):
+            if obj.exists:
+                shutil.copy(obj.path, os.path.join(path, obj.key))
+
+
+def push_cache(s3root, path):
+    """Upload the segments not yet in S3, then the index."""
+    from metaflow import S3
+
+    with open(os.path.join(path, INDEX_FILE)) as f:
+        index = json.load(f)
+    files = [seg["file"] for seg in index.get("segments", [{"file": VECTORS_FILE}])]
+    with S3(s3root=s3root) as s3:
+        uploaded = {obj.key for obj in s3.info_many(files, return_missing=True) if obj.exists}
+        new = [(name, os.path.join(path, name)) for name in files if name not in uploaded]
+        if new:
+            s3.put_files(new)
+        s3.put_files([(INDEX_FILE, os.path.join(path, INDEX_FILE))])
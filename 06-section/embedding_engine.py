@@ -0,0 +1,135 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from onnx_embedder import available_cpus
+
+_worker_encoder = None
+
+
+def _load_encoder(model_name, n_threads, onnx_path=None, encoder_factory=None):
+    if encoder_factory is not None:
+        return encoder_factory(n_threads)
+    if onnx_path is not None:
+        from onnx_embedder import OnnxEmbedder
+
+        return OnnxEmbedder(onnx_path, intra_op_threads=n_threads)
+    import torch
+    from rag_tools.embedders.embedder import SentenceTransformerEmbedder
+
+    torch.set_num_threads(n_threads)
+    return SentenceTransformerEmbedder(model_name, device="cpu")
+
+
+def _init_worker(model_name, n_threads, onnx_path=None, encoder_factory=None):
+    global _worker_encoder
+    _worker_encoder = _load_encoder(model_name, n_threads, onnx_path, encoder_factory)
+
+
+def _embed_batch(positions, texts, encoder=None):
+    """Embeddings of `texts`, with the seconds spent encoding and the process that encoded them."""
+    start = time.perf_counter()
+    vectors = np.asarray((encoder or _worker_encoder).embed(texts), dtype=np.float32)
+    return positions, vectors, time.perf_counter() - start, os.getpid()
+
+
+def approx_token_count(text):
+    return len(text.split())
+
+
+def length_sorted_batches(docs, batch_size, length_fn=approx_token_count):
+    """
+    Split positions of `docs` into batches of similar length, so each batch
+    pads to about the same sequence length. Longest batches come first so
+    the slowest work is scheduled before the pool starts to drain.
+    """
+    order = sorted(range(len(docs)), key=lambda i: length_fn(docs[i]), reverse=True)
+    return [order[i : i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+class EmbeddingEngine:
+    """
+    Embed a corpus on CPU with `SentenceTransformerEmbedder`, or with an
+    `OnnxEmbedder` if `onnx_path` is given, in length-sorted batches sharded
+    across a pool of processes that each load one copy of the model. Results
+    are written into a preallocated array in the original order of `docs` as
+    batches complete. Without a pool, the model is loaded on first use and
+    kept by the engine.
+
+    `encoder_factory`, a picklable callable taking the worker's thread count,
+    replaces the model with any object that has an `embed(texts)` method.
+    `n_threads` is the CPU budget, e.g. the CPUs requested for the step, split
+    evenly across workers. `docs_per_sec` includes pool startup and model
+    loading; `encode_docs_per_sec` only counts time spent encoding, by the
+    busiest worker.
+    """
+
+    def __init__(
+        self, model_name, batch_size=64, n_workers=None, onnx_path=None, n_threads=None, encoder_factory=None
+    ):
+        self.model_name = model_name
+        self.onnx_path = onnx_path
+        self.encoder_factory = encoder_factory
+        self.batch_size = batch_size
+        self.n_threads = n_threads or available_cpus()
+        self.n_workers = min(n_workers or self.n_threads, self.n_threads)
+        self.docs_per_sec = None
+        self.encode_docs_per_sec = None
+        self._encoder = None
+
+    def _report(self, n_docs, start, encode_s):
+        elapsed = time.perf_counter() - start
+        self.docs_per_sec = n_docs / elapsed if elapsed > 0 else float("inf")
+        self.encode_docs_per_sec = n_docs / encode_s if encode_s > 0 else float("inf")
+        print(
+            "Embedded {} docs in {:.2f}s ({:.1f} docs/sec, {:.1f} docs/sec encoding, "
+            "{} workers, {} threads, batch size {}).".format(
+                n_docs,
+                elapsed,
+                self.docs_per_sec,
+                self.encode_docs_per_sec,
+                self.n_workers,
+                self.n_threads,
+                self.batch_size,
+            )
+        )
+
+    def embed(self, docs, out=None):
+        if len(docs) == 0:
+            return self._collect([], 0, out)[0]
+        start = time.perf_counter()
+        batches = length_sorted_batches(docs, self.batch_size)
+        n_workers = min(self.n_workers, len(batches))
+
+        if n_workers <= 1:
+            if self._encoder is None:
+                self._encoder = _load_encoder(self.model_name, self.n_threads, self.onnx_path, self.encoder_factory)
+            results = (_embed_batch(b, [docs[i] for i in b], self._encoder) for b in batches)
+            out, encode_s = self._collect(results, len(docs), out)
+        else:
+            n_threads = max(1, self.n_threads // n_workers)
+            with ProcessPoolExecutor(
+                max_workers=n_workers,
+                initializer=_init_worker,
+                initargs=(self.model_name, n_threads, self.onnx_path, self.encoder_factory),
+            ) as pool:
+                futures = [pool.submit(_embed_batch, b, [docs[i] for i in b]) for b in batches]
+                results = (f.result() for f in as_completed(futures))
+                out, encode_s = self._collect(results, len(docs), out)
+
+        self._report(len(docs), start, encode_s)
+        return out
+
+    def _collect(self, results, n_docs, out):
+        """Fill `out` from batch results. Returns it and the encoding seconds of the busiest worker."""
+        encode_s = {}
+        for positions, vectors, seconds, pid in results:
+            if out is None:
+                out = np.empty((n_docs, vectors.shape[1]), dtype=np.float32)
+            out[positions] = vectors
+            encode_s[pid] = encode_s.get(pid, 0.0) + seconds
+        if out is None:
+            out = np.empty((0, 0), dtype=np.float32)
+        return out, max(encode_s.values(), default=0.0)
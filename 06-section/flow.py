@@ -1,4 +1,5 @@
-from metaflow import FlowSpec, step, Flow, namespace, current, kubernetes, environment, trigger_on_finish
+from metaflow import FlowSpec, step, Parameter, Flow, namespace, current, kubernetes, environment, trigger_on_finish
+from metaflow.metaflow_config import DATATOOLS_S3ROOT
 import os
 
 env_vars = {
@@ -7,12 +8,90 @@ env_vars = {
     "TOKENIZERS_PARALLELISM": "false"
 }
 
+# CPUs requested for create_index, and the thread budget its embedding workers split.
+EMBEDDING_CPUS = 4
+
 @trigger_on_finish(flow='DataTableProcessor')
 class PineconeVectorIndexer(FlowSpec):
 
+    vector_store = Parameter(
+        "vector_store",
+        help="Where to index and query vectors: 'pinecone', or 'local' to only use the IVF index saved in the run.",
+        default="pinecone",
+        type=str,
+    )
+
+    local_index_storage = Parameter(
+        "local_index_storage",
+        help="Storage of the local index's first-pass vectors: 'float32', 'float16' or 'int8'.",
+        default="int8",
+        type=str,
+    )
+
+    local_index_rescore = Parameter(
+        "local_index_rescore",
+        help="Whether to keep float32 vectors in the local index to rescore the top candidates of a compact first pass. "
+             "Raises recall, but the artifact then holds the float32 vectors on top of the compact ones.",
+        default=False,
+        type=bool,
+    )
+
+    embedder = Parameter(
+        "embedder",
+        help="Embedding backend: 'pytorch', or 'onnx' for an int8-quantized export run under ONNX Runtime.",
+        default="pytorch",
+        type=str,
+    )
+
+    onnx_min_cosine = 0.98
+
     index_name = "metaflow-documentation"
     embedding_model = "paraphrase-MiniLM-L6-v2"
     embedding_target_col_name = "contents"
+    embedding_cache_dir = ".embedding-cache"
+    embedding_batch_size = 64
+    embedding_workers = 4
+    # bump when the metadata written with each vector changes, so the next sync re-upserts every vector
+    metadata_schema_version = 2
+
+    def embedding_key(self):
+        """Model name that cache keys and vector ids are derived from, so backends never mix embeddings."""
+        if self.embedder == "onnx":
+            return self.embedding_model + "-onnx-int8"
+        return self.embedding_model
+
+    def vector_id_key(self):
+        """Key vector ids are derived from: the embedding key plus the metadata schema version."""
+        return "{}:metadata-v{}".format(self.embedding_key(), self.metadata_schema_version)
+
+    def embedding_cache_s3root(self):
+        if DATATOOLS_S3ROOT is None:
+            return None
+        return os.path.join(DATATOOLS_S3ROOT, current.flow_name, "embedding-cache", self.embedding_key())
+
+    def find_previous_onnx_model(self):
+        """
+        The exported ONNX model of the last successful run, if it was exported
+        from the same model and passed the parity check.
+        """
+        namespace(None)
+        try:
+            run = Flow(current.flow_name).latest_successful_run
+        except Exception:
+            return None
+        if (
+            run is None
+            or "onnx_parity_min_cosine" not in run.data
+            or run.data.onnx_model_name != self.embedding_model
+            or run.data.onnx_parity_min_cosine < self.onnx_min_cosine
+        ):
+            return None
+        return run.data.onnx_model, run.data.onnx_parity_min_cosine
+
+    def extract_onnx_model(self, path):
+        from vector_store import extract_tar_bytes
+        extract_tar_bytes(self.onnx_model, path)
+        return os.path.abspath(path)
 
     def find_processed_df(self):
         namespace(None)
@@ -22,31 +101,141 @@ class PineconeVectorIndexer(FlowSpec):
             run = Flow('DataTableProcessor').latest_successful_run
         return run.data.processed_df
 
+    def find_previous_vector_ids(self, index):
+        """
+        Ids written to Pinecone by the last successful run that synced it, if
+        the index still holds exactly that many vectors. Otherwise None, the
+        contents of the index are unknown.
+        """
+        count = index.describe_index_stats()["total_vector_count"]
+        if count == 0:
+            return []
+        namespace(None)
+        try:
+            runs = Flow(current.flow_name).runs()
+            run = next(
+                (r for r in runs if r.successful and "vector_store" in r.data and r.data.vector_store == "pinecone"),
+                None,
+            )
+        except Exception:
+            return None
+        if run is None or "vector_ids" not in run.data or count != len(set(run.data.vector_ids)):
+            return None
+        return run.data.vector_ids
+
     @kubernetes(image="registry.hub.docker.com/eddieob/rag:pinecone-vector-indexer-mf-task")
     @step
     def start(self):
+        for name, choices in [
+            ("vector_store", ("pinecone", "local")),
+            ("local_index_storage", ("float32", "float16", "int8")),
+            ("embedder", ("pytorch", "onnx")),
+        ]:
+            if getattr(self, name) not in choices:
+                raise ValueError("Unknown {} {!r}, expected one of {}.".format(name, getattr(self, name), ", ".join(choices)))
+
+        if self.embedder == "onnx":
+            # export and quantize the model once, later runs reuse the artifact
+            previous = self.find_previous_onnx_model()
+            if previous is not None:
+                self.onnx_model, self.onnx_parity_min_cosine = previous
+            else:
+                from onnx_embedder import export_onnx, parity
+                from vector_store import make_tar_bytes
+                import tempfile
+                with tempfile.TemporaryDirectory() as path:
+                    export_onnx(self.embedding_model, path)
+                    self.onnx_parity_min_cosine = float(parity(self.embedding_model, path).min())
+                    self.onnx_model = make_tar_bytes(path)
+            self.onnx_model_name = self.embedding_model
+            print("ONNX export parity with PyTorch: min cosine {:.4f}.".format(self.onnx_parity_min_cosine))
+            if self.onnx_parity_min_cosine < self.onnx_min_cosine:
+                raise ValueError(
+                    "The ONNX export of {} does not match PyTorch (min cosine {:.4f} < {}), use --embedder pytorch.".format(
+                        self.embedding_model, self.onnx_parity_min_cosine, self.onnx_min_cosine))
         self.next(self.create_index)
 
-    @kubernetes(image="registry.hub.docker.com/eddieob/rag:pinecone-vector-indexer-mf-task")
+    @kubernetes(image="registry.hub.docker.com/eddieob/rag:pinecone-vector-indexer-mf-task", cpu=EMBEDDING_CPUS)
     @environment(vars=env_vars)
     @step
     def create_index(self):
 
         # from rag_tools.databases.vector_database import PineconeDB
-        from rag_tools.embedders.embedder import SentenceTransformerEmbedder
+        from embedding_engine import EmbeddingEngine
+        from embedding_cache import EmbeddingCache, pull_cache, push_cache, content_key
+        from vector_store import IVFVectorStore, make_tar_bytes, benchmark, perturbed_queries
+        from text_store import TextStore
+        import numpy as np
+        import tempfile
         import pandas as pd
-        from pinecone import Pinecone, ServerlessSpec
-        pc = Pinecone(api_key=os.environ['PINECONE_API_KEY'])
 
-        # fetch data and embed it
-        self.data = self.find_processed_df()
-        encoder = SentenceTransformerEmbedder(self.embedding_model, device="cpu")
-        docs = self.data[self.embedding_target_col_name].tolist()
-        self.ids = list(range(1, len(docs) + 1))
-        embeddings = encoder.embed(docs)
+        # fetch data and embed it, only sending chunks missing from the cache to the encoder
+        # the processed dataframe is already an artifact of the upstream run, keep it out of this one
+        data = self.find_processed_df()
+        docs = data[self.embedding_target_col_name].tolist()
+        self.vector_ids = [content_key(self.vector_id_key(), doc) for doc in docs]
+        s3root = self.embedding_cache_s3root()
+        if s3root is not None:
+            pull_cache(s3root, self.embedding_cache_dir)
+        cache = EmbeddingCache(self.embedding_cache_dir, self.embedding_key())
+        onnx_path = self.extract_onnx_model("onnx-model") if self.embedder == "onnx" else None
+        engine = EmbeddingEngine(
+            self.embedding_model,
+            batch_size=self.embedding_batch_size,
+            n_workers=self.embedding_workers,
+            onnx_path=onnx_path,
+            n_threads=EMBEDDING_CPUS,
+        )
+        embeddings = cache.embed(docs, engine.embed)
+        self.embedding_cache_hits, self.embedding_cache_misses = cache.hits, cache.misses
+        self.embedding_docs_per_sec = engine.docs_per_sec
+        self.embedding_encode_docs_per_sec = engine.encode_docs_per_sec
+        print("Embedding cache: {} hits, {} misses.".format(cache.hits, cache.misses))
+        if s3root is not None and cache.updated:
+            push_cache(s3root, self.embedding_cache_dir)
         self.dimension = len(embeddings[0])
         self.metric = 'cosine'
 
+        # chunk text and urls live in a side store keyed by vector id, vectors only carry small filterable fields
+        with tempfile.TemporaryDirectory() as path:
+            TextStore.write(path, self.vector_ids, docs, data['page_url'].tolist())
+            self.text_store = make_tar_bytes(path)
+        if 'tld' in data.columns:
+            metadata = [{'tld': tld} for tld in data['tld'].tolist()]
+        else:
+            metadata = None
+
+        # build the local index, loaded memory-mapped at query time
+        local_index = IVFVectorStore.build(
+            self.vector_ids, embeddings, metadata, storage=self.local_index_storage, rescore=self.local_index_rescore
+        )
+        with tempfile.TemporaryDirectory() as path:
+            local_index.save(path)
+            self.local_index = make_tar_bytes(path)
+
+        # report memory saved and recall impact of the local index, using perturbed corpus vectors as queries
+        queries = perturbed_queries(embeddings, 100)
+        self.local_index_report = benchmark(local_index, self.vector_ids, embeddings, queries)
+        first_pass_bytes, rescoring_bytes = local_index.nbytes()
+        self.local_index_report.update(
+            storage=local_index.storage,
+            first_pass_bytes=first_pass_bytes,
+            rescoring_bytes=rescoring_bytes,
+            artifact_bytes=len(self.local_index),
+            float32_bytes=int(np.asarray(embeddings).nbytes),
+        )
+        print("Local index: {}".format(self.local_index_report))
+
+        if self.vector_store == "pinecone":
+            self.sync_pinecone_index(embeddings, metadata)
+
+        self.next(self.end) 
+
+    def sync_pinecone_index(self, embeddings, metadata):
+        from vector_writer import VectorWriter, list_index_ids
+        from pinecone import Pinecone, ServerlessSpec
+        pc = Pinecone(api_key=os.environ['PINECONE_API_KEY'])
+
         # create the index
         try:
             pc.create_index(
@@ -61,15 +250,33 @@ class PineconeVectorIndexer(FlowSpec):
         except:
             print('Issue creating Pinecone index. If you are on the free plan, it is likely you have already met the index quota.')
 
-        # put the vectors in the index - idempotent
+        # put the vectors in the index - idempotent, only new chunks are upserted and removed chunks are deleted
         index = pc.Index(self.index_name)
-        vectors = [
-            {'id': str(idx), 'values': emb.tolist(), 'metadata': {'text': txt},} 
-            for idx, (txt, emb) in enumerate(zip(docs, embeddings))
-        ]
-        index.upsert(vectors=vectors)
+        writer = VectorWriter(index)
+        existing_ids = list_index_ids(index)
+        if existing_ids is None:
+            existing_ids = self.find_previous_vector_ids(index)
+        if existing_ids is None:
+            # vectors we can't account for, e.g. the positional ids of older runs: start from an empty index
+            print("Could not tell which vectors are in the index, deleting them all before a full upsert.")
+            writer.delete_all()
+            existing_ids = []
+        n_upserted, n_deleted = writer.sync(
+            self.vector_ids,
+            embeddings,
+            metadata=metadata,
+            existing_ids=existing_ids,
+        )
+        print("Upserted {} vectors and deleted {} stale vectors.".format(n_upserted, n_deleted))
 
-        self.next(self.end) 
+    def load_vector_store(self, path):
+        from vector_store import IVFVectorStore, PineconeVectorStore, extract_tar_bytes
+        if self.vector_store == "local":
+            extract_tar_bytes(self.local_index, path)
+            return IVFVectorStore.load(path)
+        from pinecone import Pinecone
+        pc = Pinecone(api_key=os.environ['PINECONE_API_KEY'])
+        return PineconeVectorStore(pc.Index(self.index_name))
 
     @kubernetes(image="registry.hub.docker.com/eddieob/rag:pinecone-vector-indexer-mf-task")
     @environment(vars=env_vars)
@@ -78,9 +285,9 @@ class PineconeVectorIndexer(FlowSpec):
 
         # from rag_tools.databases.vector_database import PineconeDB
         from rag_tools.embedders.embedder import SentenceTransformerEmbedder
-        from pinecone import Pinecone, ServerlessSpec
-        pc = Pinecone(api_key=os.environ['PINECONE_API_KEY'])
-
+        from text_store import TextStore
+        from vector_store import extract_tar_bytes
+        import tempfile
 
         # create_index is idempotent
         # db = PineconeDB()
@@ -88,18 +295,30 @@ class PineconeVectorIndexer(FlowSpec):
         # search the index in a test query
         K = 3
         test_prompt = "aws"
-        encoder = SentenceTransformerEmbedder(self.embedding_model, device="cpu")
-        self._test_search_vector = encoder.embed([test_prompt])[0]
-        index = pc.Index(self.index_name)
-        matches = index.query(vector=self._test_search_vector.tolist(), top_k=K, include_metadata=True)
-        self._test_results = matches.to_dict()
+        with tempfile.TemporaryDirectory() as path:
+            if self.embedder == "onnx":
+                from onnx_embedder import OnnxEmbedder
+                encoder = OnnxEmbedder(self.extract_onnx_model(os.path.join(path, 'onnx-model')))
+            else:
+                encoder = SentenceTransformerEmbedder(self.embedding_model, device="cpu")
+            self._test_search_vector = encoder.embed([test_prompt])[0]
+            store = self.load_vector_store(os.path.join(path, 'index'))
+            self._test_results = store.query(self._test_search_vector, top_k=K, include_metadata=True)
+            extract_tar_bytes(self.text_store, os.path.join(path, 'text'))
+            TextStore.load(os.path.join(path, 'text')).hydrate(self._test_results)
         # self._test_results = db.vector_search(self.index_name, self._test_search_vector, k=K).to_dict()
 
         for result in self._test_results['matches']:
-            print("\n\nid: {} - score: {} \n\n{}\n\n".format(result['id'], result['score'], result['metadata']['text']))
+            if 'page_url' not in (result.get('metadata') or {}):
+                # a vector whose chunk is not in this run's text store
+                print("\n\nid: {} - score: {} - not in the text store, skipping.".format(result['id'], result['score']))
+                continue
+            print("\n\nid: {} - score: {} - url: {} \n\n{}\n\n".format(
+                result['id'], result['score'], result['metadata']['page_url'], result['metadata']['text']))
             print("===============================================")
 
-        print("\n\n Flow is done, check for results in the {} index at https://app.pinecone.io/.".format(self.index_name))
+        if self.vector_store == "pinecone":
+            print("\n\n Flow is done, check for results in the {} index at https://app.pinecone.io/.".format(self.index_name))
 
 
 if __name__ == '__main__':
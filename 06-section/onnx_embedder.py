@@ -0,0 +1,160 @@
+import os
+
+import numpy as np
+
+MODEL_FILE = "model.int8.onnx"
+FP32_MODEL_FILE = "model.onnx"
+OUTPUT_NAME = "last_hidden_state"
+
+
+def available_cpus():
+    """
+    CPUs this process may use: the cgroup v2 CPU quota if one is set, as in a
+    Kubernetes pod with a CPU limit, else the CPUs it may be scheduled on.
+    os.cpu_count() returns the node's core count in both cases.
+    """
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, int(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+PARITY_TEXTS = [
+    "Metaflow helps you build production machine learning workflows.",
+    "Use the @kubernetes decorator to run a step on a Kubernetes cluster.",
+    "The @pypi and @conda decorators make packages available to steps.",
+    "Artifacts are persisted automatically at the end of each step.",
+    "You can trigger a flow when another flow finishes with @trigger_on_finish.",
+    "aws",
+    # longer than the 128 token limit, so the check covers truncation and padding within a batch
+    " ".join(
+        [
+            "A flow is a directed graph of steps. Each step runs in its own process, possibly on a remote "
+            "machine, and the artifacts it assigns to self are stored and loaded by the next steps."
+        ]
+        * 6
+    ),
+]
+
+
+def _named_inputs_module(transformer, input_names):
+    """
+    Wrap `transformer` so its positional arguments follow `input_names`.
+    Exporting the transformer itself binds inputs by position, and the
+    tokenizer's key order (input_ids, token_type_ids, attention_mask) is not
+    the order of BertModel.forward (input_ids, attention_mask, token_type_ids).
+    """
+    import torch
+
+    class NamedInputs(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, *inputs):
+            return self.transformer(**dict(zip(input_names, inputs)))[0]
+
+    return NamedInputs().eval()
+
+
+def export_onnx(model_name, path, opset=14):
+    """
+    Export the transformer of a sentence-transformers model to ONNX with
+    dynamic batch and sequence axes, quantize its weights to int8 with
+    dynamic quantization, and save the tokenizer next to it.
+    """
+    import inspect
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    os.makedirs(path, exist_ok=True)
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+    tokenizer.save_pretrained(path)
+
+    sample = tokenizer(["An example sentence."], return_tensors="pt")
+    input_names = list(sample.keys())
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes[OUTPUT_NAME] = {0: "batch", 1: "sequence"}
+    export_kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # the TorchScript exporter, which is the only one in older torch versions
+        export_kwargs["dynamo"] = False
+    with torch.no_grad():
+        torch.onnx.export(
+            _named_inputs_module(transformer, input_names),
+            tuple(sample[name] for name in input_names),
+            os.path.join(path, FP32_MODEL_FILE),
+            input_names=input_names,
+            output_names=[OUTPUT_NAME],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            **export_kwargs,
+        )
+    quantize_dynamic(
+        os.path.join(path, FP32_MODEL_FILE), os.path.join(path, MODEL_FILE), weight_type=QuantType.QInt8
+    )
+    os.remove(os.path.join(path, FP32_MODEL_FILE))
+    return path
+
+
+def parity(model_name, path, texts=PARITY_TEXTS):
+    """Cosine similarity per text between the PyTorch model and the ONNX export at `path`."""
+    from sentence_transformers import SentenceTransformer
+
+    a = SentenceTransformer(model_name, device="cpu").encode(texts, convert_to_numpy=True)
+    b = OnnxEmbedder(path).embed(texts)
+    return (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+
+class OnnxEmbedder:
+    """
+    Drop-in for `SentenceTransformerEmbedder.embed` running an exported,
+    int8-quantized model under ONNX Runtime, with mean pooling over the
+    attention mask as in paraphrase-MiniLM-L6-v2.
+    """
+
+    def __init__(self, path, intra_op_threads=None, batch_size=64, max_length=128):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads or available_cpus()
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(path, MODEL_FILE), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(path)
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def embed(self, texts):
+        if isinstance(texts, str):
+            texts = [texts]
+        out = []
+        for i in range(0, len(texts), self.batch_size):
+            encoded = self.tokenizer(
+                texts[i : i + self.batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np",
+            )
+            feeds = {k: v.astype(np.int64) for k, v in encoded.items() if k in self.input_names}
+            hidden = self.session.run([OUTPUT_NAME], feeds)[0]
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            out.append((hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9))
+        if not out:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.concatenate(out).astype(np.float32)
@@ -0,0 +1,123 @@
+import json
+import os
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache, VECTORS_FILE, INDEX_FILE, content_key
+
+
+class CountingEncoder:
+    """Deterministic 4-dimensional embeddings that record every text encoded."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return np.array([[len(t), t.count("a"), t.count("b"), 1.0] for t in texts], dtype=np.float32)
+
+
+def expected(texts):
+    return CountingEncoder()(texts)
+
+
+def test_cold_then_warm(tmp_path):
+    docs = ["a", "bb", "abc"]
+    encode = CountingEncoder()
+    cache = EmbeddingCache(str(tmp_path), "model")
+    np.testing.assert_array_equal(cache.embed(docs, encode), expected(docs))
+    assert (cache.hits, cache.misses, cache.updated) == (0, 3, True)
+
+    cache = EmbeddingCache(str(tmp_path), "model")
+    vectors = cache.embed(docs, encode)
+    assert isinstance(vectors, np.memmap)
+    np.testing.assert_array_equal(vectors, expected(docs))
+    assert (cache.hits, cache.misses, cache.updated) == (3, 0, False)
+    assert encode.calls == [docs]
+
+
+def test_only_misses_are_encoded_and_appended(tmp_path):
+    encode = CountingEncoder()
+    EmbeddingCache(str(tmp_path), "model").embed(["a", "bb", "abc"], encode)
+
+    docs = ["abc", "new", "a", "newer"]
+    cache = EmbeddingCache(str(tmp_path), "model")
+    np.testing.assert_array_equal(cache.embed(docs, encode), expected(docs))
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert encode.calls[-1] == ["new", "newer"]
+
+    with open(tmp_path / INDEX_FILE) as f:
+        segments = json.load(f)["segments"]
+    assert [len(s["keys"]) for s in segments] == [3, 2]
+
+
+def test_reordered_corpus_is_gathered_without_encoding(tmp_path):
+    encode = CountingEncoder()
+    EmbeddingCache(str(tmp_path), "model").embed(["a", "bb", "abc"], encode)
+    cache = EmbeddingCache(str(tmp_path), "model")
+    docs = ["abc", "a", "bb"]
+    np.testing.assert_array_equal(cache.embed(docs, encode), expected(docs))
+    assert (cache.hits, cache.misses, cache.updated) == (3, 0, False)
+    assert len(encode.calls) == 1
+
+
+def test_removed_chunks_stay_cached(tmp_path):
+    encode = CountingEncoder()
+    EmbeddingCache(str(tmp_path), "model").embed(["a", "bb", "abc"], encode)
+    EmbeddingCache(str(tmp_path), "model").embed(["a"], encode)
+    cache = EmbeddingCache(str(tmp_path), "model")
+    cache.embed(["bb", "abc"], encode)
+    assert cache.misses == 0 and len(encode.calls) == 1
+
+
+def test_duplicates_are_encoded_once(tmp_path):
+    encode = CountingEncoder()
+    cache = EmbeddingCache(str(tmp_path), "model")
+    docs = ["a", "a", "bb", "a"]
+    np.testing.assert_array_equal(cache.embed(docs, encode), expected(docs))
+    assert (cache.hits, cache.misses) == (0, 4)
+    assert encode.calls == [["a", "bb"]]
+
+    cache = EmbeddingCache(str(tmp_path), "model")
+    np.testing.assert_array_equal(cache.embed(docs, encode), expected(docs))
+    assert (cache.hits, cache.misses) == (4, 0)
+
+
+def test_model_name_mismatch_misses(tmp_path):
+    encode = CountingEncoder()
+    EmbeddingCache(str(tmp_path), "model-a").embed(["a", "bb"], encode)
+    cache = EmbeddingCache(str(tmp_path), "model-b")
+    cache.embed(["a", "bb"], encode)
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert len(encode.calls) == 2
+    assert content_key("model-a", "a") != content_key("model-b", "a")
+
+
+def test_reads_single_file_caches(tmp_path):
+    docs = ["a", "bb"]
+    expected(docs).tofile(tmp_path / VECTORS_FILE)
+    with open(tmp_path / INDEX_FILE, "w") as f:
+        json.dump({"model": "model", "dimension": 4, "keys": [content_key("model", d) for d in docs]}, f)
+    encode = CountingEncoder()
+    cache = EmbeddingCache(str(tmp_path), "model")
+    np.testing.assert_array_equal(cache.embed(docs, encode), expected(docs))
+    assert cache.hits == 2 and not encode.calls
+
+
+def test_truncated_segment_is_ignored(tmp_path):
+    encode = CountingEncoder()
+    EmbeddingCache(str(tmp_path), "model").embed(["a", "bb"], encode)
+    with open(tmp_path / INDEX_FILE) as f:
+        segment = json.load(f)["segments"][0]["file"]
+    with open(tmp_path / segment, "r+b") as f:
+        f.truncate(8)
+    cache = EmbeddingCache(str(tmp_path), "model")
+    np.testing.assert_array_equal(cache.embed(["a", "bb"], encode), expected(["a", "bb"]))
+    assert cache.misses == 2
+    with open(tmp_path / INDEX_FILE) as f:
+        assert [s["file"] for s in json.load(f)["segments"]] == [segment]
+
+
+def test_empty_corpus(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model")
+    assert len(cache.embed([], lambda texts: np.zeros((0, 4), dtype=np.float32))) == 0
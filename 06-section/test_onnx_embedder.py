@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("sentence_transformers")
+
+from onnx_embedder import OnnxEmbedder, export_onnx, parity, PARITY_TEXTS
+
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+
+
+@pytest.fixture(scope="module")
+def tiny_model(tmp_path_factory):
+    """A small random-weight BERT with mean pooling, saved as a local sentence-transformers model."""
+    import re
+    import torch
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+    from sentence_transformers import SentenceTransformer, models
+
+    torch.manual_seed(0)
+    words = sorted({w for text in PARITY_TEXTS for w in re.findall(r"\w+|[^\w\s]", text.lower())})
+    tokenizer = BertTokenizerFast(vocab={t: i for i, t in enumerate(SPECIAL_TOKENS + words)})
+    config = BertConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=64,
+        max_position_embeddings=512,
+    )
+    path = str(tmp_path_factory.mktemp("tiny-bert"))
+    BertModel(config).save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    transformer = models.Transformer(path, max_seq_length=128)
+    pooling = models.Pooling(transformer.get_word_embedding_dimension(), pooling_mode="mean")
+    model_path = str(tmp_path_factory.mktemp("tiny-st"))
+    SentenceTransformer(modules=[transformer, pooling], device="cpu").save(model_path)
+    return model_path
+
+
+@pytest.fixture(scope="module")
+def exported(tiny_model, tmp_path_factory):
+    return export_onnx(tiny_model, str(tmp_path_factory.mktemp("onnx")))
+
+
+def test_parity_texts_cover_padding_and_truncation(exported):
+    tokenizer = OnnxEmbedder(exported).tokenizer
+    lengths = [len(tokenizer(t)["input_ids"]) for t in PARITY_TEXTS]
+    assert min(lengths) < 8
+    assert max(lengths) > 128
+
+
+def test_export_matches_pytorch(tiny_model, exported):
+    cosine = parity(tiny_model, exported)
+    assert cosine.shape == (len(PARITY_TEXTS),)
+    assert cosine.min() > 0.98
+
+
+def test_embeddings_do_not_depend_on_batch_padding(exported):
+    embedder = OnnxEmbedder(exported)
+    batched = embedder.embed(PARITY_TEXTS)
+    single = np.concatenate([embedder.embed([t]) for t in PARITY_TEXTS])
+    # dynamic quantization picks activation ranges per batch, so allow for small differences
+    cosine = (batched * single).sum(axis=1) / (np.linalg.norm(batched, axis=1) * np.linalg.norm(single, axis=1))
+    assert cosine.min() > 0.999
+
+
+def test_swapped_inputs_would_be_caught(tiny_model, exported):
+    # the bug the named-input export fixes: attention_mask fed as token_type_ids and vice versa
+    embedder = OnnxEmbedder(exported)
+    encoded = embedder.tokenizer(PARITY_TEXTS, padding=True, truncation=True, max_length=128, return_tensors="np")
+    feeds = {k: v.astype(np.int64) for k, v in encoded.items() if k in embedder.input_names}
+    feeds["attention_mask"], feeds["token_type_ids"] = feeds["token_type_ids"], feeds["attention_mask"]
+    hidden = embedder.session.run(None, feeds)[0]
+    mask = encoded["attention_mask"][..., None].astype(np.float32)
+    swapped = (hidden * mask).sum(axis=1) / mask.sum(axis=1)
+    correct = embedder.embed(PARITY_TEXTS)
+    cosine = (swapped * correct).sum(axis=1) / (np.linalg.norm(swapped, axis=1) * np.linalg.norm(correct, axis=1))
+    assert cosine.min() < 0.98
+
+
+def test_empty_input(exported):
+    assert OnnxEmbedder(exported).embed([]).shape[0] == 0
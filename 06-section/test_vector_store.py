@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+
+from vector_store import IVFVectorStore, exact_search, normalize
+
+
+def make_corpus(n=500, dimension=32, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, dimension)).astype(np.float32)
+    ids = ["doc-%d" % i for i in range(n)]
+    metadata = [{"tld": "https://site%d.org" % (i % 3)} for i in range(n)]
+    return ids, vectors, metadata
+
+
+@pytest.mark.parametrize("storage,rescore", [("float32", False), ("float16", True), ("int8", True), ("int8", False)])
+def test_save_load_round_trip(tmp_path, storage, rescore):
+    ids, vectors, metadata = make_corpus()
+    store = IVFVectorStore.build(ids, vectors, metadata, storage=storage, rescore=rescore)
+    store.save(tmp_path)
+    loaded = IVFVectorStore.load(tmp_path)
+
+    assert loaded.ids == store.ids
+    assert loaded.metadata == store.metadata
+    assert loaded.storage == store.storage
+    assert loaded.nbytes() == store.nbytes()
+    assert (loaded.vectors is None) == (store.vectors is None)
+    queries = vectors[:10]
+    expected_scores, expected_positions = store.search(queries, 5)
+    scores, positions = loaded.search(queries, 5)
+    np.testing.assert_array_equal(positions, expected_positions)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-6)
+
+
+def test_search_shape_and_recall():
+    ids, vectors, _ = make_corpus()
+    store = IVFVectorStore.build(ids, vectors, n_probe=len(vectors))
+    queries = vectors[:20] + 0.1
+    scores, positions = store.search(queries, 7)
+
+    assert scores.shape == positions.shape == (20, 7)
+    assert np.all(np.diff(scores, axis=1) <= 0)
+    # probing every list is exact search
+    _, truth = exact_search(vectors, queries, 7)
+    assert [[store.ids[p] for p in row] for row in positions] == [[ids[t] for t in row] for row in truth]
+
+
+def test_query_matches_pinecone_shape():
+    ids, vectors, metadata = make_corpus()
+    store = IVFVectorStore.build(ids, vectors, metadata)
+
+    results = store.query(vectors[3], top_k=4, include_metadata=True)
+    assert len(results["matches"]) == 4
+    assert results["matches"][0]["id"] == "doc-3"
+    assert results["matches"][0]["metadata"] == metadata[3]
+    assert set(results["matches"][0]) == {"id", "score", "metadata"}
+    assert "metadata" not in store.query(vectors[3], top_k=4)["matches"][0]
+
+
+def test_pending_upserts_are_searched_by_query():
+    ids, vectors, _ = make_corpus()
+    store = IVFVectorStore.build(ids, vectors)
+    new = np.ones(vectors.shape[1], dtype=np.float32)
+    store.upsert([{"id": "new", "values": new, "metadata": {"tld": "https://new.org"}}])
+
+    assert len(store) == len(ids) + 1
+    match = store.query(new, top_k=1, include_metadata=True)["matches"][0]
+    assert match["id"] == "new"
+    assert match["metadata"] == {"tld": "https://new.org"}
+    assert match["score"] == pytest.approx(1.0, abs=1e-5)
+    np.testing.assert_allclose(np.linalg.norm(store.pending["new"][0]), 1.0, rtol=1e-6)
+
+
+def test_top_k_larger_than_probed_lists_is_padded():
+    ids, vectors, _ = make_corpus(n=20)
+    store = IVFVectorStore.build(ids, vectors, n_lists=4, n_probe=1)
+    scores, positions = store.search(vectors[:2], 50)
+
+    list_size = np.diff(store.offsets).max()
+    for i, row in enumerate(positions):
+        found = row[row >= 0]
+        assert 0 < len(found) <= list_size
+        assert np.all(row[len(found) :] == -1)
+        assert np.all(np.isneginf(scores[i, len(found) :]))
+    assert len(store.query(vectors[0], top_k=50)["matches"]) == len(positions[0][positions[0] >= 0])
+
+
+def test_build_normalizes_vectors():
+    ids, vectors, _ = make_corpus()
+    store = IVFVectorStore.build(ids, vectors * 10)
+    np.testing.assert_allclose(np.linalg.norm(store.vectors, axis=1), 1.0, rtol=1e-5)
+    order = [ids.index(vector_id) for vector_id in store.ids]
+    np.testing.assert_allclose(store.vectors, normalize(vectors)[order], rtol=1e-5)
+
+
+@pytest.mark.parametrize("storage,rescore", [("float32", False), ("int8", True), ("int8", False)])
+def test_pending_upserts_survive_save(tmp_path, storage, rescore):
+    ids, vectors, metadata = make_corpus(n=20)
+    store = IVFVectorStore.build(ids, vectors, metadata, n_lists=4, storage=storage, rescore=rescore)
+    new = np.full(vectors.shape[1], 0.5, dtype=np.float32)
+    store.upsert([{"id": "new", "values": new, "metadata": {"tld": "https://new.org"}}])
+    store.save(tmp_path)
+    loaded = IVFVectorStore.load(tmp_path)
+
+    assert len(loaded) == 21 and not loaded.pending
+    assert sorted(loaded.ids) == sorted(ids + ["new"])
+    loaded.n_probe = 4
+    match = loaded.query(new, top_k=1, include_metadata=True)["matches"][0]
+    assert match["id"] == "new"
+    assert match["metadata"] == {"tld": "https://new.org"}
+
+
+def test_upsert_replaces_built_vector_with_same_id(tmp_path):
+    ids, vectors, _ = make_corpus(n=20)
+    store = IVFVectorStore.build(ids, vectors, n_lists=4, n_probe=4)
+    store.upsert([{"id": "doc-3", "values": vectors[5]}])
+
+    found = [m["id"] for m in store.query(vectors[5], top_k=20)["matches"]]
+    assert found.count("doc-3") == 1
+    assert len(found) == 20
+    assert found[:2] in (["doc-3", "doc-5"], ["doc-5", "doc-3"])
+
+    store.save(tmp_path)
+    loaded = IVFVectorStore.load(tmp_path)
+    assert loaded.ids.count("doc-3") == 1 and len(loaded) == 20
+    np.testing.assert_allclose(loaded.vectors[loaded.ids.index("doc-3")], normalize(vectors[5]), rtol=1e-6)
+
+
+@pytest.mark.parametrize("storage", ["float32", "int8"])
+def test_empty_index(tmp_path, storage):
+    store = IVFVectorStore.build([], np.zeros((0, 8), dtype=np.float32), storage=storage)
+    scores, positions = store.search(np.ones(8), 3)
+    assert positions.shape == (1, 3) and np.all(positions == -1)
+    assert store.query(np.ones(8), top_k=3) == {"matches": []}
+
+    store.upsert([{"id": "a", "values": np.ones(8)}, {"id": "b", "values": -np.ones(8)}])
+    store.save(tmp_path)
+    loaded = IVFVectorStore.load(tmp_path)
+    assert loaded.storage == storage
+    assert [m["id"] for m in loaded.query(np.ones(8), top_k=2)["matches"]] == ["a", "b"]
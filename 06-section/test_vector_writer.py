@@ -0,0 +1,128 @@
+import json
+
+import numpy as np
+import pytest
+
+import vector_writer
+from vector_writer import VectorWriter, InMemoryIndex, MAX_REQUEST_BYTES, list_index_ids, retry_with_jitter
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(vector_writer.time, "sleep", lambda seconds: None)
+
+
+def make_vectors(n=50, dimension=8, seed=0):
+    rng = np.random.default_rng(seed)
+    return ["id-%d" % i for i in range(n)], rng.standard_normal((n, dimension)).astype(np.float32)
+
+
+class UnlistableIndex(InMemoryIndex):
+    """A pod-based index, which can't list its ids."""
+
+    def list(self, prefix=None, limit=100):
+        raise NotImplementedError("list is only supported on serverless indexes")
+
+
+def test_sync_into_empty_index():
+    ids, embeddings = make_vectors()
+    index = InMemoryIndex()
+    metadata = [{"tld": "https://example.org"}] * len(ids)
+
+    assert VectorWriter(index).sync(ids, embeddings, metadata, existing_ids=list_index_ids(index)) == (50, 0)
+    assert set(index.vectors) == set(ids)
+    np.testing.assert_allclose(index.vectors["id-7"][0], embeddings[7])
+    assert index.vectors["id-7"][1] == {"tld": "https://example.org"}
+
+
+def test_sync_only_writes_the_difference():
+    ids, embeddings = make_vectors()
+    index = InMemoryIndex()
+    writer = VectorWriter(index)
+    writer.sync(ids, embeddings)
+    requests = index.requests
+
+    new_ids = ids[10:] + ["id-new"]
+    new_embeddings = np.concatenate([embeddings[10:], embeddings[:1]])
+    assert writer.sync(new_ids, new_embeddings, existing_ids=list_index_ids(index)) == (1, 10)
+    assert set(index.vectors) == set(new_ids)
+    assert index.requests == requests + 2
+
+    assert writer.sync(new_ids, new_embeddings, existing_ids=list_index_ids(index)) == (0, 0)
+
+
+def test_sync_deletes_ids_of_any_origin():
+    ids, embeddings = make_vectors()
+    index = InMemoryIndex()
+    # positional ids written by an older version of the flow
+    VectorWriter(index).upsert([str(i) for i in range(len(ids))], embeddings)
+
+    assert VectorWriter(index).sync(ids, embeddings, existing_ids=list_index_ids(index)) == (50, 50)
+    assert set(index.vectors) == set(ids)
+
+
+def test_unlistable_index_and_delete_all():
+    ids, embeddings = make_vectors()
+    index = UnlistableIndex()
+    writer = VectorWriter(index)
+    writer.upsert([str(i) for i in range(5)], embeddings[:5])
+
+    assert list_index_ids(index) is None
+    writer.delete_all()
+    assert index.describe_index_stats()["total_vector_count"] == 0
+    assert writer.sync(ids, embeddings, existing_ids=[]) == (50, 0)
+
+
+def test_batches_respect_request_limits():
+    ids, embeddings = make_vectors(n=100, dimension=16)
+    writer = VectorWriter(InMemoryIndex(), max_request_bytes=2048, max_batch_vectors=3)
+
+    batches = list(writer.batches(ids, embeddings))
+    assert [v["id"] for b in batches for v in b] == ids
+    assert all(len(b) <= 3 for b in batches)
+
+    writer = VectorWriter(InMemoryIndex(), max_request_bytes=2048)
+    batches = list(writer.batches(ids, embeddings))
+    assert len(batches) > 1
+    for batch in batches:
+        assert len(json.dumps({"vectors": batch, "namespace": ""})) <= 2048
+
+
+def test_batches_of_unit_vectors_stay_under_pinecone_limit():
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((2000, 384)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    ids = ["%040x" % i for i in range(len(embeddings))]
+    metadata = [{"tld": "https://docs.metaflow.org"}] * len(ids)
+
+    for batch in VectorWriter(InMemoryIndex()).batches(ids, embeddings, metadata):
+        assert len(json.dumps({"vectors": batch, "namespace": ""})) <= MAX_REQUEST_BYTES
+
+
+def test_failed_requests_are_retried():
+    ids, embeddings = make_vectors(n=200)
+    index = InMemoryIndex(fail_every=3)
+    writer = VectorWriter(index, max_batch_vectors=10, max_in_flight=4)
+
+    assert writer.sync(ids, embeddings) == (200, 0)
+    assert set(index.vectors) == set(ids)
+    assert index.requests > 20
+    assert writer.sync(ids[:100], embeddings[:100], existing_ids=list_index_ids(index)) == (0, 100)
+    assert set(index.vectors) == set(ids[:100])
+
+
+def test_retry_gives_up_after_max_attempts():
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise RuntimeError("unavailable")
+
+    with pytest.raises(RuntimeError):
+        retry_with_jitter(fail, max_attempts=3)
+    assert len(calls) == 3
+
+    index = InMemoryIndex(fail_every=1)
+    ids, embeddings = make_vectors(n=5)
+    with pytest.raises(RuntimeError):
+        VectorWriter(index, max_attempts=2).upsert(ids, embeddings)
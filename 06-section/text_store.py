@@ -0,0 +1,82 @@
+import os
+import json
+
+import numpy as np
+
+TEXT_FILE = "text.bin"
+OFFSETS_FILE = "offsets.npy"
+URL_INDEX_FILE = "url_index.npy"
+KEYS_FILE = "keys.json"
+
+
+class TextStore:
+    """
+    Chunk text and page URLs keyed by vector id, so vectors only need to
+    carry ids. Text is one UTF-8 blob read through np.memmap, sliced with an
+    offsets array. URLs repeat across the chunks of a page, so they are kept
+    once in a table and referenced by index.
+    """
+
+    def __init__(self, blob, offsets, url_index, urls, rows):
+        self.blob = blob
+        self.offsets = offsets
+        self.url_index = url_index
+        self.urls = urls
+        self.rows = rows
+
+    @staticmethod
+    def write(path, ids, texts, urls):
+        os.makedirs(path, exist_ok=True)
+        rows, url_rows, url_table = {}, {}, []
+        offsets, url_index = [0], []
+        with open(os.path.join(path, TEXT_FILE), "wb") as f:
+            for vector_id, text, url in zip(ids, texts, urls):
+                if vector_id in rows:
+                    continue
+                rows[vector_id] = len(rows)
+                offsets.append(offsets[-1] + f.write(text.encode("utf-8")))
+                if url not in url_rows:
+                    url_rows[url] = len(url_table)
+                    url_table.append(url)
+                url_index.append(url_rows[url])
+        np.save(os.path.join(path, OFFSETS_FILE), np.array(offsets, dtype=np.int64))
+        np.save(os.path.join(path, URL_INDEX_FILE), np.array(url_index, dtype=np.int32))
+        with open(os.path.join(path, KEYS_FILE), "w") as f:
+            json.dump({"ids": list(rows), "urls": url_table}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, KEYS_FILE)) as f:
+            keys = json.load(f)
+        text_path = os.path.join(path, TEXT_FILE)
+        blob = np.memmap(text_path, dtype=np.uint8, mode="r") if os.path.getsize(text_path) else b""
+        return cls(
+            blob,
+            np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r"),
+            np.load(os.path.join(path, URL_INDEX_FILE), mmap_mode="r"),
+            keys["urls"],
+            {vector_id: row for row, vector_id in enumerate(keys["ids"])},
+        )
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get_many(self, ids):
+        """Look up `ids` in one pass, in blob order. Missing ids map to None."""
+        found = sorted((self.rows[i], i) for i in set(ids) if i in self.rows)
+        records = {}
+        for row, vector_id in found:
+            start, end = self.offsets[row], self.offsets[row + 1]
+            records[vector_id] = {
+                "text": bytes(self.blob[start:end]).decode("utf-8"),
+                "page_url": self.urls[self.url_index[row]],
+            }
+        return [records.get(i) for i in ids]
+
+    def hydrate(self, results):
+        """Add text and page_url to the metadata of each match of a query result."""
+        matches = results["matches"]
+        for match, record in zip(matches, self.get_many([m["id"] for m in matches])):
+            if record is not None:
+                match["metadata"] = {**(match.get("metadata") or {}), **record}
+        return results
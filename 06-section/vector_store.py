@@ -0,0 +1,369 @@
+import os
+import json
+import time
+from io import BytesIO
+from tarfile import TarFile
+
+import numpy as np
+
+
+def normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-12)
+
+
+def top_k_rows(scores, k):
+    """Indices of the k highest scores per row, best first."""
+    k = min(k, scores.shape[1])
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+
+def exact_search(vectors, queries, k):
+    scores = normalize(queries) @ normalize(vectors).T
+    rows = top_k_rows(scores, k)
+    return np.take_along_axis(scores, rows, axis=1), rows
+
+
+def make_tar_bytes(source_dir):
+    buf = BytesIO()
+    with TarFile(mode="w", fileobj=buf) as tar:
+        tar.add(source_dir, arcname=".")
+    return buf.getvalue()
+
+
+def extract_tar_bytes(tar_bytes, path):
+    with TarFile(mode="r", fileobj=BytesIO(tar_bytes)) as tar:
+        tar.extractall(path=path)
+
+
+class ScalarQuantizer:
+    """
+    Per-dimension scalar quantization to int8, x ~= offset + scale * code,
+    or a plain cast to float16 (scale 1, offset 0).
+    """
+
+    def __init__(self, dtype, scale=None, offset=None):
+        self.dtype = np.dtype(dtype)
+        self.scale = scale
+        self.offset = offset
+
+    def fit(self, x):
+        if self.dtype == np.int8:
+            lo, hi = x.min(axis=0), x.max(axis=0)
+            self.offset = ((hi + lo) / 2).astype(np.float32)
+            self.scale = np.maximum((hi - lo) / 254, 1e-12).astype(np.float32)
+        else:
+            self.offset = np.zeros(x.shape[1], dtype=np.float32)
+            self.scale = np.ones(x.shape[1], dtype=np.float32)
+        return self
+
+    def encode(self, x):
+        if self.dtype == np.int8:
+            return np.clip(np.rint((x - self.offset) / self.scale), -127, 127).astype(np.int8)
+        return x.astype(self.dtype)
+
+    def decode(self, codes):
+        return codes.astype(np.float32) * self.scale + self.offset
+
+    def scores(self, codes, q):
+        """Approximate inner products of decoded `codes` with `q`, without decoding."""
+        return codes.astype(np.float32) @ (q * self.scale) + q @ self.offset
+
+
+class VectorStore:
+    """
+    What the flows' test queries need from an index: `query` returns a dict
+    shaped like Pinecone's `index.query(...).to_dict()`. Writes to Pinecone
+    go through `VectorWriter` on the raw index.
+    """
+
+    def query(self, vector, top_k=10, include_metadata=False):
+        raise NotImplementedError
+
+
+class PineconeVectorStore(VectorStore):
+    def __init__(self, index):
+        self.index = index
+
+    def query(self, vector, top_k=10, include_metadata=False):
+        vector = vector.tolist() if isinstance(vector, np.ndarray) else vector
+        return self.index.query(vector=vector, top_k=top_k, include_metadata=include_metadata).to_dict()
+
+
+class IVFVectorStore(VectorStore):
+    """
+    Local inverted-file index for cosine similarity. Vectors are clustered
+    with spherical k-means and stored grouped by cluster, so a query scans
+    only the `n_probe` clusters whose centroids are closest. Saved as .npy
+    files that `load` opens memory-mapped. Vectors upserted after `build`
+    are kept in memory and searched exactly by `query`, replacing built
+    vectors with the same id, and are added to the lists of their nearest
+    centroids by `merge_pending`, which `save` calls.
+
+    With `storage` "int8" or "float16", clusters are scanned over compact
+    codes. If `rescore` is set, float32 vectors are kept too and the best
+    `rescore_factor * top_k` candidates are rescored exactly; only those rows
+    of the memory-mapped float32 file are read.
+    """
+
+    def __init__(
+        self, centroids, vectors, offsets, ids, metadata, n_probe=8, codes=None, quantizer=None, rescore_factor=4
+    ):
+        self.centroids = centroids
+        self.vectors = vectors
+        self.offsets = offsets
+        self.ids = ids
+        self.metadata = metadata
+        self.n_probe = n_probe
+        self.codes = codes
+        self.quantizer = quantizer
+        self.rescore_factor = rescore_factor
+        self.pending = {}
+
+    @classmethod
+    def build(
+        cls, ids, embeddings, metadata=None, n_lists=None, n_iter=10, n_probe=8, seed=0, storage="float32", rescore=True
+    ):
+        x = normalize(embeddings)
+        n = len(x)
+        if n == 0:
+            return cls._empty(x.shape[1] if x.ndim == 2 else 0, n_probe, storage, rescore)
+        n_lists = n_lists or max(1, int(np.sqrt(n)))
+        n_lists = min(n_lists, n)
+        rng = np.random.default_rng(seed)
+        centroids = x[rng.choice(n, n_lists, replace=False)]
+        for _ in range(n_iter):
+            assign = cls._assign(x, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, x)
+            empty = np.bincount(assign, minlength=n_lists) == 0
+            sums[empty] = centroids[empty]
+            centroids = normalize(sums)
+        assign = cls._assign(x, centroids)
+        order = np.argsort(assign, kind="stable")
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assign, minlength=n_lists))
+        x = x[order]
+        codes, quantizer = None, None
+        if storage != "float32":
+            quantizer = ScalarQuantizer(storage).fit(x)
+            codes = quantizer.encode(x)
+            if not rescore:
+                x = None
+        return cls(
+            centroids,
+            x,
+            offsets,
+            [ids[i] for i in order],
+            [metadata[i] for i in order] if metadata else None,
+            n_probe=n_probe,
+            codes=codes,
+            quantizer=quantizer,
+        )
+
+    @classmethod
+    def _empty(cls, dimension, n_probe, storage, rescore):
+        x = np.zeros((0, dimension), dtype=np.float32)
+        codes, quantizer = None, None
+        if storage != "float32":
+            quantizer = ScalarQuantizer(
+                storage, np.ones(dimension, dtype=np.float32), np.zeros(dimension, dtype=np.float32)
+            )
+            codes = quantizer.encode(x)
+            if not rescore:
+                x = None
+        return cls(
+            np.zeros((0, dimension), dtype=np.float32),
+            x,
+            np.zeros(1, dtype=np.int64),
+            [],
+            None,
+            n_probe=n_probe,
+            codes=codes,
+            quantizer=quantizer,
+        )
+
+    @staticmethod
+    def _assign(x, centroids, chunk_size=65536):
+        return np.concatenate(
+            [np.argmax(x[i : i + chunk_size] @ centroids.T, axis=1) for i in range(0, len(x), chunk_size)]
+        )
+
+    @property
+    def storage(self):
+        return "float32" if self.quantizer is None else self.quantizer.dtype.name
+
+    def nbytes(self):
+        """Bytes scanned by the first pass, and bytes kept for rescoring."""
+        first_pass = self.vectors if self.codes is None else self.codes
+        rescoring = 0 if self.codes is None or self.vectors is None else self.vectors.nbytes
+        return first_pass.nbytes, rescoring
+
+    def merge_pending(self):
+        """
+        Add pending vectors to the lists of their nearest centroids, replacing
+        built vectors with the same id. Centroids are not retrained, so
+        rebuild the index once many vectors have been merged.
+        """
+        if not self.pending:
+            return
+        keep = np.array([vector_id not in self.pending for vector_id in self.ids], dtype=bool)
+        new_ids = list(self.pending)
+        new = np.stack([v for v, _ in self.pending.values()]).astype(np.float32)
+        new_metadata = [m for _, m in self.pending.values()]
+        old_metadata = self.metadata or [None] * len(self.ids)
+        ids = [i for i, k in zip(self.ids, keep) if k] + new_ids
+        metadata = [m for m, k in zip(old_metadata, keep) if k] + new_metadata
+        metadata = metadata if any(m is not None for m in metadata) else None
+        if len(self.ids) == 0:
+            # nothing to assign to, build the lists from the pending vectors
+            built = self.build(
+                ids, new, metadata, n_probe=self.n_probe, storage=self.storage, rescore=self.vectors is not None
+            )
+            self.__dict__.update(built.__dict__)
+            return
+
+        n_lists = len(self.centroids)
+        assign = np.concatenate(
+            [np.repeat(np.arange(n_lists), np.diff(self.offsets))[keep], self._assign(new, self.centroids)]
+        )
+        order = np.argsort(assign, kind="stable")
+        self.offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(np.bincount(assign, minlength=n_lists))
+        self.ids = [ids[i] for i in order]
+        self.metadata = [metadata[i] for i in order] if metadata else None
+        if self.vectors is not None:
+            self.vectors = np.concatenate([np.asarray(self.vectors)[keep], new])[order]
+        if self.codes is not None:
+            self.codes = np.concatenate([np.asarray(self.codes)[keep], self.quantizer.encode(new)])[order]
+        self.pending = {}
+
+    def save(self, path):
+        self.merge_pending()
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "centroids.npy"), self.centroids)
+        np.save(os.path.join(path, "offsets.npy"), self.offsets)
+        if self.vectors is not None:
+            np.save(os.path.join(path, "vectors.npy"), self.vectors)
+        if self.codes is not None:
+            np.save(os.path.join(path, "codes.npy"), self.codes)
+            np.save(os.path.join(path, "scale.npy"), self.quantizer.scale)
+            np.save(os.path.join(path, "offset.npy"), self.quantizer.offset)
+        with open(os.path.join(path, "ids.json"), "w") as f:
+            json.dump(
+                {"ids": self.ids, "metadata": self.metadata, "n_probe": self.n_probe, "storage": self.storage}, f
+            )
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        with open(os.path.join(path, "ids.json")) as f:
+            meta = json.load(f)
+
+        def load_array(name):
+            array_path = os.path.join(path, name)
+            return np.load(array_path, mmap_mode=mmap_mode) if os.path.exists(array_path) else None
+
+        codes, quantizer = None, None
+        if meta.get("storage", "float32") != "float32":
+            codes = load_array("codes.npy")
+            quantizer = ScalarQuantizer(
+                meta["storage"], np.load(os.path.join(path, "scale.npy")), np.load(os.path.join(path, "offset.npy"))
+            )
+        return cls(
+            np.load(os.path.join(path, "centroids.npy")),
+            load_array("vectors.npy"),
+            np.load(os.path.join(path, "offsets.npy")),
+            meta["ids"],
+            meta["metadata"],
+            n_probe=meta["n_probe"],
+            codes=codes,
+            quantizer=quantizer,
+        )
+
+    def __len__(self):
+        return len(self.ids) + len(self.pending)
+
+    def upsert(self, vectors):
+        for v in vectors:
+            self.pending[v["id"]] = (normalize(v["values"]), v.get("metadata"))
+        return {"upserted_count": len(vectors)}
+
+    def search(self, queries, top_k=10):
+        """
+        Batched search. Returns (scores, positions) arrays of shape
+        (len(queries), top_k); positions index `self.ids`, padded with -1.
+        Pending vectors are not searched.
+        """
+        q = normalize(np.atleast_2d(queries))
+        n_probe = min(self.n_probe, len(self.centroids))
+        probes = top_k_rows(q @ self.centroids.T, n_probe)
+        scores = np.full((len(q), top_k), -np.inf, dtype=np.float32)
+        positions = np.full((len(q), top_k), -1, dtype=np.int64)
+        if len(self.ids) == 0:
+            return scores, positions
+        for i, lists in enumerate(probes):
+            rows = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+            if len(rows) == 0:
+                continue
+            if self.codes is None:
+                s = np.asarray(self.vectors[rows]) @ q[i]
+            else:
+                s = self.quantizer.scores(np.asarray(self.codes[rows]), q[i])
+                if self.vectors is not None and self.rescore_factor:
+                    candidates = top_k_rows(s[None, :], top_k * self.rescore_factor)[0]
+                    rows = rows[candidates]
+                    s = np.asarray(self.vectors[rows]) @ q[i]
+            best = top_k_rows(s[None, :], top_k)[0]
+            scores[i, : len(best)] = s[best]
+            positions[i, : len(best)] = rows[best]
+        return scores, positions
+
+    def query(self, vector, top_k=10, include_metadata=False):
+        # built vectors replaced by pending ones are skipped, so search deep enough to still fill top_k
+        scores, positions = self.search(vector, top_k + len(self.pending))
+        matches = [
+            {"id": self.ids[p], "score": float(s), "metadata": self.metadata[p] if self.metadata else None}
+            for s, p in zip(scores[0], positions[0])
+            if p >= 0 and self.ids[p] not in self.pending
+        ]
+        q = normalize(vector)
+        for vector_id, (v, metadata) in self.pending.items():
+            matches.append({"id": vector_id, "score": float(v @ q), "metadata": metadata})
+        matches = sorted(matches, key=lambda m: -m["score"])[:top_k]
+        if not include_metadata:
+            for m in matches:
+                del m["metadata"]
+        return {"matches": matches}
+
+
+def perturbed_queries(vectors, n, noise=0.5, seed=0):
+    """
+    `n` queries near, but not at, random rows of `vectors`: each row plus
+    Gaussian noise of about `noise` times its norm. Queries copied from the
+    corpus find themselves first and overstate recall.
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.asarray(vectors[np.sort(rng.choice(len(vectors), min(n, len(vectors)), replace=False))], dtype=np.float32)
+    scale = noise * np.linalg.norm(rows, axis=1, keepdims=True) / np.sqrt(rows.shape[1])
+    return rows + rng.standard_normal(rows.shape).astype(np.float32) * scale
+
+
+def benchmark(store, ids, vectors, queries, k=10):
+    """Recall@k and per-query latency of `store.search` against exact search."""
+    _, truth = exact_search(vectors, queries, k)
+    recalls, latencies = [], []
+    for q, t in zip(queries, truth):
+        start = time.perf_counter()
+        _, positions = store.search(q, k)
+        latencies.append(time.perf_counter() - start)
+        found = {store.ids[p] for p in positions[0] if p >= 0}
+        recalls.append(len(found & {ids[r] for r in t}) / k)
+    latencies = np.array(latencies) * 1000
+    return {
+        "recall_at_k": float(np.mean(recalls)),
+        "k": k,
+        "latency_ms_p50": float(np.percentile(latencies, 50)),
+        "latency_ms_p99": float(np.percentile(latencies, 99)),
+    }
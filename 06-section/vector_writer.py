@@ -0,0 +1,196 @@
+import json
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+# Pinecone rejects upsert requests over 2MB or 1000 vectors.
+MAX_REQUEST_BYTES = 2 * 1024 * 1024
+MAX_BATCH_VECTORS = 1000
+# Room for the rest of the request body, e.g. {"vectors": [...], "namespace": ""}.
+REQUEST_OVERHEAD_BYTES = 256
+SEPARATOR_BYTES = len(", ")
+
+
+def payload_bytes(vector):
+    """
+    Bytes of `vector` in the JSON body of an upsert request. Values are
+    serialized as Python floats, about 20 characters per float32 component.
+    """
+    return len(json.dumps(vector).encode("utf-8"))
+
+
+def retry_with_jitter(fn, max_attempts=5, base_delay=0.5, max_delay=20.0):
+    """Call `fn`, retrying failures with full-jitter exponential backoff."""
+    for attempt in range(max_attempts):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == max_attempts - 1:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2**attempt))
+            print("Request failed ({}), retrying in {:.2f}s.".format(e, delay))
+            time.sleep(delay)
+
+
+def list_index_ids(index):
+    """
+    Every id in `index`, read with the paginated `list` of serverless
+    Pinecone indexes. None if the index cannot list its ids.
+    """
+    if not hasattr(index, "list"):
+        return None
+    try:
+        return [vector_id for page in index.list() for vector_id in page]
+    except Exception as e:
+        print("Could not list the ids in the index ({}).".format(e))
+        return None
+
+
+class VectorWriter:
+    """
+    Write vectors to an index with a Pinecone-style `upsert(vectors=...)` and
+    `delete(ids=...)` API. Upserts are split into batches that stay under the
+    request size limit and sent from a thread pool with at most
+    `max_in_flight` requests outstanding. Given the ids already in the index,
+    `sync` only upserts new ids and deletes ids that are no longer present.
+    """
+
+    def __init__(
+        self,
+        index,
+        max_request_bytes=MAX_REQUEST_BYTES,
+        max_batch_vectors=MAX_BATCH_VECTORS,
+        max_in_flight=4,
+        max_attempts=5,
+    ):
+        self.index = index
+        self.max_request_bytes = max_request_bytes
+        self.max_batch_vectors = max_batch_vectors
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+
+    def batches(self, ids, embeddings, metadata=None):
+        """Upsert payloads, lists of vectors whose serialized size stays under the request limits."""
+        max_bytes = self.max_request_bytes - REQUEST_OVERHEAD_BYTES
+        batch, batch_bytes = [], 0
+        for i, vector_id in enumerate(ids):
+            vector = {"id": vector_id, "values": np.asarray(embeddings[i], dtype=np.float32).tolist()}
+            if metadata:
+                vector["metadata"] = metadata[i]
+            size = payload_bytes(vector) + SEPARATOR_BYTES
+            if batch and (batch_bytes + size > max_bytes or len(batch) >= self.max_batch_vectors):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(vector)
+            batch_bytes += size
+        if batch:
+            yield batch
+
+    def _requests(self, ids, embeddings, metadata):
+        for vectors in self.batches(ids, embeddings, metadata):
+            yield lambda vectors=vectors: self.index.upsert(vectors=vectors)
+
+    def _run(self, requests):
+        n_requests = 0
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            pending = set()
+            for request in requests:
+                if len(pending) >= self.max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in done:
+                        f.result()
+                pending.add(pool.submit(retry_with_jitter, request, self.max_attempts))
+                n_requests += 1
+            for f in wait(pending).done:
+                f.result()
+        return n_requests
+
+    def upsert(self, ids, embeddings, metadata=None):
+        return self._run(self._requests(ids, embeddings, metadata))
+
+    def delete(self, ids, batch_size=MAX_BATCH_VECTORS):
+        ids = list(ids)
+        requests = (
+            lambda chunk=ids[i : i + batch_size]: self.index.delete(ids=chunk)
+            for i in range(0, len(ids), batch_size)
+        )
+        return self._run(requests)
+
+    def delete_all(self):
+        retry_with_jitter(lambda: self.index.delete(delete_all=True), self.max_attempts)
+
+    def sync(self, ids, embeddings, metadata=None, existing_ids=None):
+        """
+        Make the index hold exactly `ids`. Returns the number of vectors
+        upserted and deleted.
+        """
+        existing = set(existing_ids or [])
+        positions = [i for i, vector_id in enumerate(ids) if vector_id not in existing]
+        stale = existing - set(ids)
+        if positions:
+            self.upsert(
+                [ids[i] for i in positions],
+                embeddings[positions],
+                [metadata[i] for i in positions] if metadata else None,
+            )
+        if stale:
+            self.delete(sorted(stale))
+        return len(positions), len(stale)
+
+
+class InMemoryIndex:
+    """
+    In-process stand-in for a Pinecone index, for running the writer and the
+    flows without network access.
+    """
+
+    def __init__(self, fail_every=0):
+        self.vectors = {}
+        self.requests = 0
+        self.fail_every = fail_every
+
+    def _maybe_fail(self):
+        self.requests += 1
+        if self.fail_every and self.requests % self.fail_every == 0:
+            raise RuntimeError("Simulated failure on request %d" % self.requests)
+
+    def upsert(self, vectors):
+        self._maybe_fail()
+        for v in vectors:
+            self.vectors[v["id"]] = (np.asarray(v["values"], dtype=np.float32), v.get("metadata"))
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids=None, delete_all=False):
+        self._maybe_fail()
+        if delete_all:
+            self.vectors.clear()
+        for vector_id in ids or []:
+            self.vectors.pop(vector_id, None)
+        return {}
+
+    def list(self, prefix=None, limit=100):
+        ids = [i for i in self.vectors if prefix is None or i.startswith(prefix)]
+        for start in range(0, len(ids), limit):
+            yield ids[start : start + limit]
+
+    def describe_index_stats(self):
+        return {"total_vector_count": len(self.vectors)}
+
+    def query(self, vector, top_k=10, include_metadata=False):
+        ids = list(self.vectors)
+        if not ids:
+            return {"matches": []}
+        matrix = np.stack([self.vectors[i][0] for i in ids])
+        query = np.asarray(vector, dtype=np.float32)
+        scores = matrix @ query / (
+            np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12
+        )
+        matches = []
+        for i in np.argsort(-scores)[:top_k]:
+            match = {"id": ids[i], "score": float(scores[i])}
+            if include_metadata:
+                match["metadata"] = self.vectors[ids[i]][1]
+            matches.append(match)
+        return {"matches": matches}
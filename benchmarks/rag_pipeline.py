@@ -0,0 +1,301 @@
+"""
+Offline benchmark of the RAG pipeline stages on a synthetic markdown repo.
+
+Each stage runs the code of its flow: the MarkdownChunker mixin of
+rag_tools chunks a generated local git repo, and DataTableProcessor's
+`process_chunks` filters the chunks. S3 is replaced with a temporary
+directory and Pinecone with `InMemoryIndex`. Wall time, peak memory and
+throughput are recorded per stage and corpus size, and written as JSON so
+reports from two commits can be compared with `--compare`. On Linux the
+peak RSS is reset before each stage, so `peak_rss_mb` is the stage's own
+peak; elsewhere only the process peak so far is reported, as
+`process_peak_rss_mb`. `--trace-memory` adds a per-stage tracemalloc peak,
+at the cost of slowing down allocation-heavy stages.
+
+    python benchmarks/rag_pipeline.py --sizes 100 1000 --output report.json
+    python benchmarks/rag_pipeline.py --compare before.json after.json
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import resource
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "05-section"))
+sys.path.insert(0, os.path.join(ROOT, "06-section"))
+
+from processing import process_chunks
+from embedding_cache import EmbeddingCache, content_key
+from embedding_engine import EmbeddingEngine
+from text_store import TextStore
+from vector_store import IVFVectorStore, make_tar_bytes, extract_tar_bytes, perturbed_queries
+from vector_writer import VectorWriter, InMemoryIndex
+
+WORDS = (
+    "flow step artifact run metaflow kubernetes batch decorator parameter card conda pypi "
+    "deploy argo schedule trigger event namespace client data model train score cloud "
+    "resource memory cpu gpu retry timeout catch project branch tag secret config"
+).split()
+
+
+def paragraph(rng, n_words):
+    return " ".join(rng.choice(WORDS) for _ in range(n_words)).capitalize() + "."
+
+
+def generate_repo(path, n_pages, seed=0, copied_fraction=0.2):
+    """
+    Write `n_pages` markdown pages with headed sections, paragraphs and code
+    blocks, and commit them to a git repo at `path`. A fraction of pages get a
+    near-copy in another topic, like pages repeated across the Metaflow docs.
+    Returns the branch to check out.
+    """
+    rng = random.Random(seed)
+    for i in range(n_pages):
+        sections = []
+        for s in range(rng.randint(2, 6)):
+            body = "\n\n".join(paragraph(rng, rng.randint(5, 80)) for _ in range(rng.randint(1, 3)))
+            if rng.random() < 0.3:
+                body += "\n\n```python\nfrom metaflow import FlowSpec, step\n```"
+            sections.append("## Section %d\n\n%s" % (s, body))
+        page = "# Page %d\n\n%s\n" % (i, "\n\n".join(sections))
+        os.makedirs(os.path.join(path, "docs", "topic%d" % (i % 20)), exist_ok=True)
+        with open(os.path.join(path, "docs", "topic%d" % (i % 20), "page%d.md" % i), "w") as f:
+            f.write(page)
+        if rng.random() < copied_fraction:
+            os.makedirs(os.path.join(path, "docs", "topic%d" % ((i + 1) % 20)), exist_ok=True)
+            with open(os.path.join(path, "docs", "topic%d" % ((i + 1) % 20), "page%d-copy.md" % i), "w") as f:
+                f.write(page.replace("Section 0", "Section 0 (copy)"))
+    git = ["git", "-c", "user.name=benchmark", "-c", "user.email=benchmark@example.org"]
+    for command in (["init", "-q"], ["add", "-A"], ["commit", "-q", "-m", "Generated docs"]):
+        subprocess.check_call(git + command, cwd=path)
+    return subprocess.check_output(git + ["rev-parse", "--abbrev-ref", "HEAD"], cwd=path, text=True).strip()
+
+
+def chunk_repo(path, ref, deployment_url="docs.example.org"):
+    """Chunk the repo at `path` with the MarkdownChunker flow's mixin and its repo parameters."""
+    from rag_tools.filetypes.markdown import Mixin as MarkdownMixin
+
+    chunker = MarkdownMixin()
+    chunker.repo_params = [
+        {
+            "deployment_url": deployment_url,
+            "repository_path": path,
+            "repository_ref": ref,
+            "base_search_path": "docs",
+            "exclude_paths": ["docs/v"],
+            "exclude_files": ["README.md", "README"],
+        }
+    ]
+    return chunker.load_df_from_repo_list()
+
+
+class HashingEmbedder:
+    """Deterministic stand-in for the sentence-transformers model: hashed bag of words."""
+
+    def __init__(self, dimension=384):
+        self.dimension = dimension
+
+    def embed(self, texts):
+        out = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for token in text.lower().split():
+                out[i, zlib.crc32(token.encode("utf-8")) % self.dimension] += 1.0
+        return out
+
+
+def hashing_encoder(n_threads):
+    return HashingEmbedder()
+
+
+def make_engine(name, n_workers=None, batch_size=64):
+    """The EmbeddingEngine of the indexer flow, with the hashing stand-in or the real model."""
+    model_name = "paraphrase-MiniLM-L6-v2"
+    if name == "hashing":
+        return EmbeddingEngine(model_name, batch_size, n_workers, encoder_factory=hashing_encoder)
+    if name == "onnx":
+        from onnx_embedder import export_onnx
+
+        return EmbeddingEngine(model_name, batch_size, n_workers, onnx_path=export_onnx(model_name, tempfile.mkdtemp()))
+    return EmbeddingEngine(model_name, batch_size, n_workers)
+
+
+def reset_peak_rss():
+    """Reset the peak RSS of this process, which Linux supports through /proc. Returns whether it was reset."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """Peak RSS since the last reset on Linux, otherwise the process peak."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+TRACE_MEMORY = False
+
+
+def run_stage(name, fn, n_items_fn):
+    per_stage = reset_peak_rss()
+    if TRACE_MEMORY:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    wall_s = time.perf_counter() - start
+    n_items = n_items_fn(result)
+    report = {
+        "stage": name,
+        "wall_s": wall_s,
+        "items": n_items,
+        "items_per_sec": n_items / wall_s if wall_s > 0 else None,
+    }
+    report["peak_rss_mb" if per_stage else "process_peak_rss_mb"] = peak_rss_mb()
+    if TRACE_MEMORY:
+        report["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+    return result, report
+
+
+def run_pipeline(n_pages, engine, n_queries=100, k=5):
+    stages = []
+    with tempfile.TemporaryDirectory() as workdir:
+        repo = os.path.join(workdir, "repo")
+        ref, report = run_stage("generate", lambda: generate_repo(repo, n_pages), lambda _: n_pages)
+        stages.append(report)
+
+        df, report = run_stage("chunk", lambda: chunk_repo(repo, ref), len)
+        stages.append(report)
+
+        n_chunks = len(df)
+        (df, _), report = run_stage("process", lambda: process_chunks(df), lambda _: n_chunks)
+        report["items_out"] = len(df)
+        stages.append(report)
+
+        docs = df["contents"].tolist()
+        cache = EmbeddingCache(os.path.join(workdir, "cache"), "benchmark")
+        embeddings, report = run_stage("embed_cold", lambda: cache.embed(docs, engine.embed), len)
+        report["encode_docs_per_sec"] = engine.encode_docs_per_sec
+        stages.append(report)
+        _, report = run_stage("embed_warm", lambda: cache.embed(docs, engine.embed), len)
+        stages.append(report)
+
+        ids = [content_key("benchmark", d) for d in docs]
+
+        def upsert():
+            index = InMemoryIndex()
+            VectorWriter(index).sync(ids, embeddings, metadata=None)
+            return index
+
+        _, report = run_stage("upsert", upsert, lambda index: len(index.vectors))
+        stages.append(report)
+
+        def build_local_index():
+            # the S3 stand-in is a local directory holding the tarred artifacts
+            with tempfile.TemporaryDirectory() as path:
+                IVFVectorStore.build(ids, embeddings, storage="int8", rescore=False).save(os.path.join(path, "index"))
+                TextStore.write(os.path.join(path, "text"), ids, docs, df["page_url"].tolist())
+                return make_tar_bytes(os.path.join(path, "index")), make_tar_bytes(os.path.join(path, "text"))
+
+        (index_tar, text_tar), report = run_stage("index", build_local_index, lambda _: len(ids))
+        report["artifact_mb"] = (len(index_tar) + len(text_tar)) / (1024 * 1024)
+        stages.append(report)
+
+        extract_tar_bytes(index_tar, os.path.join(workdir, "index"))
+        extract_tar_bytes(text_tar, os.path.join(workdir, "text"))
+        store = IVFVectorStore.load(os.path.join(workdir, "index"))
+        text_store = TextStore.load(os.path.join(workdir, "text"))
+        queries = perturbed_queries(embeddings, n_queries)
+
+        def query():
+            _, positions = store.search(queries, k)
+            return text_store.get_many([store.ids[p] for row in positions for p in row if p >= 0])
+
+        _, report = run_stage("query", query, lambda _: len(queries))
+        stages.append(report)
+
+    return {"n_pages": n_pages, "n_chunks": n_chunks, "stages": stages}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(before_path, after_path, metric="wall_s"):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    old = {(r["n_pages"], s["stage"]): s for r in before["runs"] for s in r["stages"]}
+    print("%8s %-12s %12s %12s %8s" % ("pages", "stage", "before", "after", "ratio"))
+    for run in after["runs"]:
+        for s in run["stages"]:
+            prev = old.get((run["n_pages"], s["stage"]))
+            if prev is None or not prev.get(metric) or s.get(metric) is None:
+                continue
+            print(
+                "%8d %-12s %12.4f %12.4f %8.2f"
+                % (run["n_pages"], s["stage"], prev[metric], s[metric], s[metric] / prev[metric])
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the RAG pipeline stages.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000], help="Corpus sizes in pages.")
+    parser.add_argument("--embedder", default="hashing", choices=["hashing", "pytorch", "onnx"])
+    parser.add_argument("--workers", type=int, default=4, help="Embedding workers, as in the indexer flow.")
+    parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout.")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two reports.")
+    parser.add_argument("--metric", default="wall_s", help="Stage metric to compare.")
+    parser.add_argument("--trace-memory", action="store_true", help="Record a per-stage tracemalloc peak.")
+    args = parser.parse_args()
+
+    global TRACE_MEMORY
+    TRACE_MEMORY = args.trace_memory
+
+    if args.compare:
+        compare(*args.compare, metric=args.metric)
+        return
+
+    engine = make_engine(args.embedder, n_workers=args.workers)
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "embedder": args.embedder,
+        "embedding_workers": engine.n_workers,
+        "runs": [run_pipeline(n, engine) for n in args.sizes],
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
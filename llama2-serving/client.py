@@ -13,15 +13,20 @@ def user_text_to_inputs(
 def user_text_to_inputs(
     input_text=[
         ["Who is Lionel Messi?"],
-    ]
+    ],
+    use_retrieval=True,
 ):
     # Define input config
     text_obj = np.array(input_text, dtype="object")
+    retrieval_obj = np.full((len(input_text), 1), use_retrieval, dtype=bool)
 
     inputs = [
         httpclient.InferInput(
             "prompt", text_obj.shape, np_to_triton_dtype(text_obj.dtype)
         ).set_data_from_numpy(text_obj),
+        httpclient.InferInput(
+            "use_retrieval", retrieval_obj.shape, np_to_triton_dtype(retrieval_obj.dtype)
+        ).set_data_from_numpy(retrieval_obj),
     ]
 
     # Define output config
@@ -50,8 +55,8 @@ def time_single_request():
     print(f"Total time elapsed: {tm2-tm1:0.2f} seconds")
 
 
-def chat_iter(user_prompt, model_version="1"):
-    inputs, outputs = user_text_to_inputs([[user_prompt]])
+def chat_iter(user_prompt, model_version="1", use_retrieval=True):
+    inputs, outputs = user_text_to_inputs([[user_prompt]], use_retrieval=use_retrieval)
 
     with httpclient.InferenceServerClient(
         url="localhost:8000", verbose=False, concurrency=32
@@ -78,8 +83,9 @@ def batch_inference(
     ],
     model_version="1",
     loud=True,
+    use_retrieval=True,
 ):
-    inputs, outputs = user_text_to_inputs(user_prompts)
+    inputs, outputs = user_text_to_inputs(user_prompts, use_retrieval=use_retrieval)
 
     with httpclient.InferenceServerClient(
         url="localhost:8000", verbose=False, concurrency=32
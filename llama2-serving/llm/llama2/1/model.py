@@ -18,6 +18,7 @@ from metaflow import S3
 
 import logging
 import sys
+import time
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
@@ -29,6 +30,9 @@ PUBLIC_S3_OBJ = "s3://outerbounds-datasets/triton/llama2/%s_%s.tar" % (
 )
 CHECKPOINT_MODEL_PATH = "%s/model" % DST_MODEL_NAME
 CHECKPOINT_TOKENIZER_PATH = "%s/tokenizer" % DST_MODEL_NAME
+# PineconeVectorIndexer run to retrieve context from, latest successful run if unset.
+RETRIEVAL_RUN_PATHSPEC = os.environ.get("RETRIEVAL_RUN_PATHSPEC")
+RETRIEVAL_TOP_K = 3
 
 
 def extract_tar_bytes(tar_bytes, path):
@@ -70,6 +74,15 @@ class TritonPythonModel:
         self.task = "text-generation"
         self.max_length = 200
 
+        # serve without retrieval, as if every request set use_retrieval=False, if the index can't be loaded
+        try:
+            from retrieval import Retriever
+
+            self.retriever = Retriever(RETRIEVAL_RUN_PATHSPEC, top_k=RETRIEVAL_TOP_K)
+        except Exception:
+            logging.exception("Could not load the retrieval index, serving without retrieval.")
+            self.retriever = None
+
     def get_prompt(self, user_input: str, context: str):
         return format_prompt(
             {
@@ -81,22 +94,38 @@ class TritonPythonModel:
             }
         )
 
-    def execute(self, requests):
-        responses = []
-        for request in requests:
-            # Decode the Byte Tensor into Text
-            inputs = pb_utils.get_input_tensor_by_name(request, "prompt")
-            inputs = inputs.as_numpy()
+    def use_retrieval(self, request):
+        if self.retriever is None:
+            return False
+        flag = pb_utils.get_input_tensor_by_name(request, "use_retrieval")
+        return flag is None or bool(flag.as_numpy().all())
 
-            context = []  # TODO: retrieve this from a RAG pipeline!
+    def execute(self, requests):
+        # Decode the Byte Tensors into Text
+        user_inputs = [
+            [i[0].decode() for i in pb_utils.get_input_tensor_by_name(request, "prompt").as_numpy()]
+            for request in requests
+        ]
+
+        # Retrieve context for all prompts of the batch at once
+        queries = [
+            q for request, inputs in zip(requests, user_inputs) if self.use_retrieval(request) for q in inputs
+        ]
+        contexts, retrieval_s = self.retriever.retrieve(queries) if queries else ([], 0.0)
+        contexts = iter(contexts)
 
-            prompts = [self.get_prompt(i[0].decode(), context) for i in inputs]
+        responses = []
+        generation_s = 0.0
+        for request, inputs in zip(requests, user_inputs):
+            use_retrieval = self.use_retrieval(request)
+            prompts = [self.get_prompt(i, next(contexts) if use_retrieval else "") for i in inputs]
             self.tokenizer.pad_token = self.tokenizer.eos_token
             self.tokenizer.padding_side = "right"
             inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(
                 "cuda"
             )
 
+            start = time.perf_counter()
             output_sequences = self.model.generate(
                 **inputs,
                 do_sample=True,
@@ -106,6 +135,7 @@ class TritonPythonModel:
                 top_k=20,
                 repetition_penalty=1.1,
             )
+            generation_s += time.perf_counter() - start
 
             output = self.tokenizer.batch_decode(
                 output_sequences, skip_special_tokens=True
@@ -122,7 +152,13 @@ class TritonPythonModel:
             )
             responses.append(inference_response)
 
+        logging.info(
+            "Batch of %d requests: retrieval for %d prompts took %.1fms, generation took %.1fms."
+            % (len(requests), len(queries), retrieval_s * 1000, generation_s * 1000)
+        )
         return responses
 
     def finalize(self, args):
         self.generator = None
+        if self.retriever is not None:
+            self.retriever.close()
@@ -0,0 +1,131 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+import importlib.util
+from collections import OrderedDict
+
+import numpy as np
+from metaflow import Flow, Run, namespace
+
+INDEXER_FLOW_NAME = "PineconeVectorIndexer"
+
+
+def load_module(code_path, name):
+    """
+    Import `name`.py from an extracted code package by path, under a prefixed
+    module name so it never shadows, or is shadowed by, modules on sys.path.
+    """
+    spec = importlib.util.spec_from_file_location("indexer_" + name, os.path.join(code_path, name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class LRUCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+
+    def get(self, key):
+        if key not in self.items:
+            return None
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+
+class Retriever:
+    """
+    Retrieval over the local index and text store artifacts of a
+    PineconeVectorIndexer run. The run's code package is extracted to load
+    the same `vector_store` and `text_store` modules that wrote the artifacts.
+    Raises if the run, its artifacts or its code package can't be loaded.
+    Files are extracted to `path`, or to a temporary directory that `close`
+    removes.
+    """
+
+    def __init__(self, run_pathspec=None, top_k=3, cache_size=4096, path=None):
+        self.owns_path = path is None
+        self.path = path or tempfile.mkdtemp(prefix="retrieval-")
+        try:
+            self._load(run_pathspec)
+        except Exception:
+            self.close()
+            raise
+        self.top_k = top_k
+        self.cache = LRUCache(cache_size)
+
+    def _load(self, run_pathspec):
+        namespace(None)
+        run = Run(run_pathspec) if run_pathspec else Flow(INDEXER_FLOW_NAME).latest_successful_run
+        if run is None:
+            raise ValueError("No successful %s run to retrieve from." % INDEXER_FLOW_NAME)
+        missing = [name for name in ("local_index", "text_store") if name not in run.data]
+        if missing:
+            raise ValueError("Run %s has no %s artifact." % (run.pathspec, " or ".join(missing)))
+        if run.code is None:
+            raise ValueError("Run %s has no code package, it was likely run locally." % run.pathspec)
+        code_path = os.path.join(self.path, "code")
+        run.code.tarball.extractall(code_path)
+        vector_store = load_module(code_path, "vector_store")
+        text_store = load_module(code_path, "text_store")
+
+        vector_store.extract_tar_bytes(run.data.local_index, os.path.join(self.path, "index"))
+        vector_store.extract_tar_bytes(run.data.text_store, os.path.join(self.path, "text"))
+        self.index = vector_store.IVFVectorStore.load(os.path.join(self.path, "index"))
+        self.text_store = text_store.TextStore.load(os.path.join(self.path, "text"))
+        if "embedder" in run.data and run.data.embedder == "onnx":
+            onnx_embedder = load_module(code_path, "onnx_embedder")
+            vector_store.extract_tar_bytes(run.data.onnx_model, os.path.join(self.path, "onnx-model"))
+            self.encoder = onnx_embedder.OnnxEmbedder(os.path.join(self.path, "onnx-model"))
+        else:
+            from rag_tools.embedders.embedder import SentenceTransformerEmbedder
+
+            self.encoder = SentenceTransformerEmbedder(run.data.embedding_model, device="cpu")
+        logging.info(
+            "Loaded retrieval index with %d chunks from %s." % (len(self.text_store), run.pathspec)
+        )
+
+    def close(self):
+        if self.owns_path:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def embed(self, queries):
+        """Embed `queries`, running one forward pass over those not in the LRU cache."""
+        vectors = {q: self.cache.get(q) for q in queries}
+        misses = [q for q, v in vectors.items() if v is None]
+        if misses:
+            # use the computed vectors, the cache may evict some of them when misses outnumber its size
+            for q, v in zip(misses, self.encoder.embed(misses)):
+                vectors[q] = v
+                self.cache.put(q, v)
+        return np.stack([vectors[q] for q in queries])
+
+    def retrieve(self, queries):
+        """
+        Returns a context string per query, and the retrieval latency in
+        seconds for the whole batch. Queries are embedded and probed against
+        the centroids together; each query's lists are then scanned in turn.
+        """
+        start = time.perf_counter()
+        _, positions = self.index.search(self.embed(queries), self.top_k)
+        ids = [[self.index.ids[p] for p in row if p >= 0] for row in positions]
+        records = self.text_store.get_many([i for row in ids for i in row])
+        contexts, offset = [], 0
+        for row in ids:
+            contexts.append(
+                "".join(
+                    "\n### context: {}\n### url: {} \n".format(r["text"], r["page_url"])
+                    for r in records[offset : offset + len(row)]
+                    if r is not None
+                )
+            )
+            offset += len(row)
+        return contexts, time.perf_counter() - start